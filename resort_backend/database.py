@@ -1,4 +1,5 @@
-import motor.motor_asyncio
+from pymongo import AsyncMongoClient
+from pymongo.errors import ConfigurationError, ConnectionFailure
 import os
 import logging
 from dotenv import load_dotenv
@@ -11,43 +12,77 @@ logger = logging.getLogger("resort_backend.database")
 # Read env inside connect_db to pick up runtime env changes
 DATABASE_NAME = os.getenv("DATABASE_NAME", "resort_db")
 
+# Number of pooled connections kept open and opened eagerly at startup
+POOL_WARMUP_SIZE = 10
+
 client = None
 db = None
 
 async def connect_db():
-    """Initialize MongoDB client and database handle using env vars."""
+    """Initialize MongoDB client and database handle using env vars.
+
+    Returns a ``(client, db)`` tuple; both are ``None`` when the database is
+    not configured or unreachable.
+    """
     global client, db
     MONGODB_URL = os.getenv("MONGODB_URL")
     if not MONGODB_URL:
         logger.error("MONGODB_URL not set; database will not be initialized")
         client = None
         db = None
-        return
+        return client, db
+    client = None
     try:
-        # Use a reasonable serverSelectionTimeout to fail fast in dev
-        client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL, serverSelectionTimeoutMS=5000)
+        # Keep a few warm connections so the first requests don't pay for pool
+        # creation. Idle sockets live for 5 minutes so bursts reuse them, and
+        # maxConnecting caps concurrent handshakes so a burst can't open a storm
+        # of new connections (a small busy pool beats a big cold one). Requests
+        # wait at most 2s for a free socket and server selection fails in 3s,
+        # so an unhealthy database surfaces as an error instead of a hang.
+        client = AsyncMongoClient(
+            MONGODB_URL,
+            minPoolSize=POOL_WARMUP_SIZE,
+            maxPoolSize=100,
+            maxIdleTimeMS=300_000,
+            maxConnecting=4,
+            waitQueueTimeoutMS=2000,
+            serverSelectionTimeoutMS=3000,
+        )
         # verify connection with a ping (awaitable)
-        try:
-            await client.admin.command("ping")
-        except Exception:
-            logger.exception("MongoDB ping failed after client creation")
-            client.close()
-            client = None
-            db = None
-            return
+        await client.admin.command("ping")
         db = client[DATABASE_NAME]
         logger.info("Connected to MongoDB database=%s", DATABASE_NAME)
-    except Exception:
-        logger.exception("Failed to connect to MongoDB")
+    except (ConfigurationError, ConnectionFailure, OSError) as exc:
+        # Expected when the server is unreachable or MONGODB_URL is malformed;
+        # anything else is a bug and should fail startup loudly.
+        logger.error("Failed to connect to MongoDB: %s", exc)
+        if client is not None:
+            await client.close()
         client = None
         db = None
+    return client, db
+
+async def supports_transactions(client) -> bool:
+    """True when the deployment can run multi-document transactions.
+
+    Sessions exist on every server, but transactions need a replica set
+    member or a mongos, so ask the server what it is instead.
+    """
+    if client is None:
+        return False
+    try:
+        hello = await client.admin.command("hello")
+    except (ConnectionFailure, OSError) as exc:
+        logger.error("Could not determine transaction support: %s", exc)
+        return False
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
 
 async def close_db():
     """Close MongoDB connection if open."""
     global client
-    if client:
+    if client is not None:
         try:
-            client.close()
+            await client.close()
             logger.info("Disconnected from MongoDB")
         except Exception:
             logger.exception("Error while closing MongoDB connection")
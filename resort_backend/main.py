@@ -1,105 +1,193 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import Limiter
-from slowapi.middleware import SlowAPIMiddleware
+from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 from dotenv import load_dotenv
 import os
-from datetime import datetime
+from datetime import datetime, timezone
+
+_HERE = os.path.dirname(__file__)
+_DOTENV = os.path.join(_HERE, ".env")
+_UPLOADS = os.path.join(_HERE, "uploads")
 
 # Ensure .env is loaded before importing route modules so route-level
 # module-scope env reads (e.g. INTERNAL_API_KEY) pick up values.
-load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
-import database
-from database import connect_db, close_db, get_db
+load_dotenv(_DOTENV)
+from database import connect_db, close_db, supports_transactions, POOL_WARMUP_SIZE
+from utils import NAME_COLLATION
+from pymongo.errors import ConnectionFailure, PyMongoError
 from routes import accommodations, packages, experiences, wellness, bookings, home, menu_items, gallery, api_compat, internal_status, navigation, api_site
-from routes import events, extra_beds, programs
+from routes import events, extra_beds, programs, auth, guests
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import Response
-import json
-import os
-from dotenv import load_dotenv
+from fastapi.responses import ORJSONResponse, Response
+import orjson
+
+async def _cleanup_stale_locks(db_handle):
+    """Ensure the `locks` TTL index exists and sweep locks that already expired."""
+    logger = logging.getLogger("resort_backend")
+    try:
+        # With the TTL index MongoDB removes expired locks server-side; the name
+        # matches scripts/create_indexes.py so both paths agree on one index.
+        await db_handle.locks.create_index("expire_at", name="locks_expire_ttl", expireAfterSeconds=0)
+        # Remove expired locks where expire_at < now. expire_at stays a BSON Date
+        # because TTL indexes ignore non-date values.
+        now = datetime.now(timezone.utc)
+        await db_handle.locks.delete_many({"expire_at": {"$lt": now}})
+        logger.info("Cleaned up stale locks on startup")
+    except (PyMongoError, OSError) as exc:
+        logger.error("Failed to cleanup stale locks on startup: %s", exc)
+
+
+async def _sweep_stale_uploads():
+    """Remove .part files from resumable uploads that were abandoned."""
+    logger = logging.getLogger("resort_backend")
+    try:
+        removed = await gallery.sweep_stale_uploads()
+        if removed:
+            logger.info("Removed %d stale upload part files", removed)
+    except OSError as exc:
+        logger.error("Failed to sweep stale uploads: %s", exc)
+
+
+async def _migrate_accommodation_ids(db_handle):
+    # Store ObjectId-shaped accommodation_id strings as ObjectIds so stored ids
+    # converge on one form (lookups still accept both, see _acc_key).
+    res = await db_handle.rooms.update_many(
+        {"accommodation_id": {"$type": "string", "$regex": "^[0-9a-fA-F]{24}$"}},
+        [{"$set": {"accommodation_id": {"$toObjectId": "$accommodation_id"}}}],
+    )
+    return f"normalised accommodation_id on {res.modified_count} rooms"
+
+
+async def _backfill_guest_email_lc(db_handle):
+    # Bookings written before guest_email_lc existed; matches nothing once done.
+    res = await db_handle.bookings.update_many(
+        {"guest_email_lc": None, "guest_email": {"$type": "string"}},
+        [{"$set": {"guest_email_lc": {"$toLower": "$guest_email"}}}],
+    )
+    return f"backfilled guest_email_lc on {res.modified_count} bookings"
+
+
+async def _ensure_indexes(db_handle):
+    """Create the indexes request handlers rely on (no-op when they already exist).
+
+    Each step runs on its own, so one failure is logged against its step and
+    the rest still run.
+    """
+    logger = logging.getLogger("resort_backend")
+    steps = [
+        # One occupancy per room-night; both booking paths rely on the
+        # duplicate-key error. Same name as scripts/create_indexes.py.
+        ("occupancies accom_date_unique_idx", lambda: db_handle.occupancies.create_index(
+            [("accommodation_id", 1), ("date", 1)], name="accom_date_unique_idx", unique=True)),
+        ("rooms_accommodation_id_idx", lambda: db_handle.rooms.create_index([("accommodation_id", 1)], name="rooms_accommodation_id_idx")),
+        # Case-insensitive name lookups in /api/rooms/name and /api/cottages
+        ("rooms_name_ci", lambda: db_handle.rooms.create_index([("name", 1)], name="rooms_name_ci", collation=NAME_COLLATION)),
+        ("accommodations_name_ci", lambda: db_handle.accommodations.create_index([("name", 1)], name="accommodations_name_ci", collation=NAME_COLLATION)),
+        # Date-overlap scans for /api/cottages availability filtering
+        ("bookings_status_dates_idx", lambda: db_handle.bookings.create_index(
+            [("status", 1), ("check_in", 1), ("check_out", 1)], name="bookings_status_dates_idx")),
+        # Overlap/conflict checks in both booking paths, and guest/user lookups
+        ("bookings_accom_status_dates_idx", lambda: db_handle.bookings.create_index(
+            [("accommodation_id", 1), ("status", 1), ("check_in", 1), ("check_out", 1)], name="bookings_accom_status_dates_idx")),
+        ("bookings_alloc_status_dates_idx", lambda: db_handle.bookings.create_index(
+            [("allocated_cottages", 1), ("status", 1), ("check_in", 1), ("check_out", 1)], name="bookings_alloc_status_dates_idx")),
+        ("bookings_guest_email_lc_idx", lambda: db_handle.bookings.create_index([("guest_email_lc", 1)], name="bookings_guest_email_lc_idx")),
+        ("bookings_user_id_idx", lambda: db_handle.bookings.create_index([("user_id", 1)], name="bookings_user_id_idx")),
+        ("guest_email_lc backfill", lambda: _backfill_guest_email_lc(db_handle)),
+        # Gallery docs from before isVisible was always written count as visible;
+        # storing it lets list_gallery match {"isVisible": True} on the index.
+        ("gallery isVisible backfill", lambda: db_handle.gallery.update_many({"isVisible": {"$exists": False}}, {"$set": {"isVisible": True}})),
+        ("gallery_category_visible_created_idx", lambda: db_handle.gallery.create_index(
+            [("category", 1), ("isVisible", 1), ("createdAt", -1), ("_id", -1)], name="gallery_category_visible_created_idx")),
+        ("gallery_visible_created_idx", lambda: db_handle.gallery.create_index(
+            [("isVisible", 1), ("createdAt", -1), ("_id", -1)], name="gallery_visible_created_idx")),
+        # Upload dedup looks files up by their content hash
+        ("gallery_content_hash_idx", lambda: db_handle.gallery.create_index([("content_hash", 1)], name="gallery_content_hash_idx", sparse=True)),
+        # Newest-first keyset pages in /menu-items
+        ("menu_items_created_id_idx", lambda: db_handle.menu_items.create_index(
+            [("created_at", -1), ("_id", -1)], name="menu_items_created_id_idx")),
+        # Abandoned resumable uploads expire UPLOAD_TTL_SECONDS after their last range
+        ("gallery_uploads_ttl_idx", lambda: db_handle.gallery_uploads.create_index(
+            "updatedAt", name="gallery_uploads_ttl_idx", expireAfterSeconds=gallery.UPLOAD_TTL_SECONDS)),
+    ]
+    if _MIGRATE_ACCOMMODATION_IDS:
+        steps.insert(0, ("accommodation_id migration", lambda: _migrate_accommodation_ids(db_handle)))
+    for label, step in steps:
+        try:
+            result = await step()
+        except (PyMongoError, OSError) as exc:
+            logger.error("Startup index step %s failed: %s", label, exc)
+            continue
+        if isinstance(result, str):
+            logger.info("Startup index step %s: %s", label, result)
 
-# Load .env into the process environment so runtime env vars (e.g. API_KEY) are available
-load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
-    await connect_db()
+    # Startup: connect_db() pings the server and returns (None, None) on failure
+    client, db_handle = await connect_db()
     # attach db handle to app.state for routes to access
-    try:
-        # Attach live references from the database module so they reflect
-        # values set by connect_db() at runtime.
-        app.state.db = database.get_db()
-        app.state.db_client = getattr(database, "client", None)
-        # Log DB attachment and attempt a quick ping to surface connectivity issues early
-        logger = logging.getLogger("resort_backend")
-        logger.info("App startup: DB attached to app.state (db set: %s, client set: %s)", app.state.db is not None, app.state.db_client is not None)
+    app.state.db = db_handle
+    app.state.db_client = client
+    # Checked once here so booking handlers can branch on a plain bool
+    app.state.supports_txn = await supports_transactions(client)
+    logger = logging.getLogger("resort_backend")
+    logger.info("App startup: DB attached to app.state (db set: %s, client set: %s, transactions: %s)", db_handle is not None, client is not None, app.state.supports_txn)
+    if _DOCS_ENABLED:
+        # Build the OpenAPI schema now (it is cached on the app) so the first
+        # /docs visit doesn't pay for walking every route model.
+        app.openapi()
+    if db_handle is not None:
+        # Open the pool's sockets now with concurrent no-op commands so the first
+        # burst of requests doesn't serialize on connection setup.
         try:
-            client = getattr(app.state, "db_client", None)
-            if client is not None:
-                # support async motor client ping
-                cmd = client.admin.command("ping")
-                if hasattr(cmd, "__await__"):
-                    await cmd
-                else:
-                    # sync pymongo client
-                    client.admin.command("ping")
-                logger.info("App startup: DB ping successful")
-                # Cleanup stale locks left from previous runs (best-effort)
-                try:
-                    db_handle = getattr(app.state, "db", None)
-                    if db_handle is not None:
-                        # Remove expired locks where expire_at < now
-                        await db_handle.locks.delete_many({"expire_at": {"$lt": datetime.utcnow()}})
-                        logger.info("Cleaned up stale locks on startup")
-                except Exception:
-                    logger.exception("Failed to cleanup stale locks on startup")
-        except Exception:
-            logger.exception("App startup: DB ping failed")
-        # Fallback: if database not attached, try to create a client directly (helps local dev when connect_db didn't set globals)
-        if getattr(app.state, "db", None) is None or getattr(app.state, "db_client", None) is None:
-            try:
-                import motor.motor_asyncio
-                from os import getenv
-                MONGODB_URL = getenv("MONGODB_URL")
-                from database import DATABASE_NAME
-                if MONGODB_URL:
-                    logger.info("Attempting fallback DB client creation using MONGODB_URL from environment")
-                    fb_client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL, serverSelectionTimeoutMS=5000)
-                    try:
-                        cmd = fb_client.admin.command("ping")
-                        if hasattr(cmd, "__await__"):
-                            await cmd
-                        else:
-                            fb_client.admin.command("ping")
-                        app.state.db_client = fb_client
-                        app.state.db = fb_client[DATABASE_NAME]
-                        logger.info("Fallback DB client created and ping successful")
-                    except Exception:
-                        logger.exception("Fallback DB ping failed")
-            except Exception:
-                logger.exception("Fallback DB client creation failed")
-    except Exception:
-        logging.getLogger("resort_backend").exception("Error attaching DB to app.state")
+            await asyncio.gather(*[db_handle.command("ping") for _ in range(POOL_WARMUP_SIZE)])
+        except (ConnectionFailure, OSError) as exc:
+            logger.error("App startup: DB pool warm-up failed: %s", exc)
+        # Cleanup stale locks left from previous runs (best-effort). Runs in the
+        # background so uvicorn can start accepting requests immediately.
+        app.state._cleanup_task = asyncio.create_task(_cleanup_stale_locks(db_handle))
+        app.state._index_task = asyncio.create_task(_ensure_indexes(db_handle))
+    app.state._upload_sweep_task = asyncio.create_task(_sweep_stale_uploads())
     yield
     # Shutdown
+    for name in ("_cleanup_task", "_index_task", "_upload_sweep_task"):
+        task = getattr(app.state, name, None)
+        if task is not None and not task.done():
+            try:
+                await asyncio.wait_for(task, timeout=5)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
     await close_db()
 
+# One-off data fix run with the startup index pass; enable once per deployment.
+_MIGRATE_ACCOMMODATION_IDS = os.getenv("MIGRATE_ACCOMMODATION_IDS", "").lower() in ("1", "true")
+
+# Swagger/ReDoc and the OpenAPI schema are dev tooling; drop the routes in production.
+_DOCS_ENABLED = os.getenv("ENVIRONMENT", "").lower() not in ("production", "prod")
+
 app = FastAPI(
     title="Resort Backend API",
     description="FastAPI backend for resort booking system",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+    docs_url="/docs" if _DOCS_ENABLED else None,
+    redoc_url="/redoc" if _DOCS_ENABLED else None,
+    openapi_url="/openapi.json" if _DOCS_ENABLED else None,
 )
 
-# Configure rate limiter
+# Configure rate limiter. Limits are applied per-route with `@limiter.limit(...)`
+# rather than through SlowAPIMiddleware, which is BaseHTTPMiddleware-based and
+# adds a task group + stream copy to every request even when no limit applies.
 limiter = Limiter(key_func=get_remote_address)
 app.state.limiter = limiter
-app.add_middleware(SlowAPIMiddleware)
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
 # Add CORS middleware
 app.add_middleware(
@@ -110,87 +198,132 @@ app.add_middleware(
     ],
     # Do not allow credentials when using wildcard origin
     allow_credentials=False,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # Explicit lists let Starlette answer preflights from precomputed header
+    # values instead of reflecting Access-Control-Request-Headers each time.
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
+    allow_headers=["Authorization", "Content-Type", "X-API-Key", "X-Admin-Key", "X-Internal-Key", "X-Requested-With", "If-None-Match", "Content-Range"],
+    # Let browsers cache preflight results for a day
+    max_age=86400,
 )
 
-# Include routers
-app.include_router(home.router)
-app.include_router(accommodations.router)
-app.include_router(packages.router)
-app.include_router(experiences.router)
-app.include_router(wellness.router)
-app.include_router(bookings.router)
-app.include_router(api_compat.router)
-app.include_router(api_site.router)
-app.include_router(menu_items.router)
-app.include_router(gallery.router)
-app.include_router(navigation.router)
-# Also include navigation router under /api for backwards compatibility with some clients
-app.include_router(navigation.router, prefix="/api")
-# Include gallery under /api for compatibility with clients expecting /api/gallery
-app.include_router(gallery.router, prefix="/api")
-app.include_router(internal_status.router)
-app.include_router(events.router)
-app.include_router(extra_beds.router)
-# Expose extra beds under /api for frontend compatibility
-app.include_router(extra_beds.router, prefix="/api")
-app.include_router(programs.router)
-# Authentication routes
-from routes import auth
-app.include_router(auth.router)
-from routes import guests
-app.include_router(guests.router)
-# Mount navigation router under /api for frontend compatibility (some clients expect /api/navigation)
-app.include_router(navigation.router, prefix="/api")
-
-# Serve uploaded files from /uploads
-uploads_path = os.path.join(os.path.dirname(__file__), "uploads")
-os.makedirs(uploads_path, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=uploads_path), name="uploads")
-
-@app.get("/")
-async def root():
-    return {
-        "message": "Welcome to Resort Backend API",
-        "docs": "/docs",
-        "version": "1.0.0"
-    }
-
-
-@app.get("/site/site-config.js")
-async def site_config_js_root():
-    # Provide a tiny JS snippet used by the frontend dev toolbar
-    config = {"apiBase": "/api", "siteName": "Resort"}
-    body = "window.__SITE_CONFIG__ = " + json.dumps(config) + ";"
-    return Response(content=body, media_type="application/javascript")
-
-
-# Compatibility route: some frontends request the site-config under /api
-@app.get("/api/site/site-config.js")
-async def site_config_js_api():
-    config = {"apiBase": "/api", "siteName": "Resort"}
-    body = "window.__SITE_CONFIG__ = " + json.dumps(config) + ";"
-    return Response(content=body, media_type="application/javascript")
-
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
-
-
-@app.get("/debug/routes")
-async def debug_routes():
+# Include routers. A router mounted under two prefixes is listed twice; the
+# (router, prefix) pair is the unit of registration, so exact repeats are skipped.
+_ROUTERS = [
+    (home.router, None),
+    (accommodations.router, None),
+    (packages.router, None),
+    (experiences.router, None),
+    (wellness.router, None),
+    (bookings.router, None),
+    (api_compat.router, None),
+    (api_site.router, None),
+    (menu_items.router, None),
+    (gallery.router, None),
+    (navigation.router, None),
+    # Also include navigation router under /api for backwards compatibility with some clients
+    (navigation.router, "/api"),
+    # Include gallery under /api for compatibility with clients expecting /api/gallery
+    (gallery.router, "/api"),
+    (internal_status.router, None),
+    (events.router, None),
+    (extra_beds.router, None),
+    # Expose extra beds under /api for frontend compatibility
+    (extra_beds.router, "/api"),
+    (programs.router, None),
+    # Authentication routes
+    (auth.router, None),
+    (guests.router, None),
+]
+
+_registered = set()
+for _router, _prefix in _ROUTERS:
+    _key = (id(_router), _prefix)
+    if _key in _registered:
+        continue
+    _registered.add(_key)
+    if _prefix:
+        app.include_router(_router, prefix=_prefix)
+    else:
+        app.include_router(_router)
+del _registered
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that marks served files as long-lived and publicly cacheable.
+
+    Uploaded filenames are timestamp-prefixed and never rewritten, so clients can
+    cache them indefinitely; StaticFiles already answers If-None-Match with a 304.
+    """
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers.setdefault("Cache-Control", "public, max-age=2592000, immutable")
+        return response
+
+
+# Serve uploaded files from /uploads. In production set SERVE_UPLOADS_PY=0 and
+# let the reverse proxy serve the directory (see README_DOCKER.md).
+os.makedirs(_UPLOADS, exist_ok=True)
+if os.getenv("SERVE_UPLOADS_PY", "1") == "1":
+    app.mount("/uploads", CachedStaticFiles(directory=_UPLOADS), name="uploads")
+
+class _StaticJSON:
+    """Bare ASGI endpoint that answers with a pre-encoded JSON body.
+
+    Used for constant payloads so requests skip FastAPI's dependency solving and
+    response encoding as well as Starlette's Request/Response wrappers.
+    """
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": self.headers})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+# `/` and `/health` return constant payloads (the latter is polled by load
+# balancers), so they are served straight from pre-encoded bytes.
+_ROOT_BODY = orjson.dumps({
+    "message": "Welcome to Resort Backend API",
+    "docs": "/docs",
+    "version": "1.0.0"
+})
+_HEALTH_BODY = orjson.dumps({"status": "healthy"})
+
+app.add_route("/", _StaticJSON(_ROOT_BODY), methods=["GET"], include_in_schema=False)
+
+
+# Same handler (shared body, ETag and 304 handling) as /api/site/site-config.js
+app.add_api_route("/site/site-config.js", api_compat.site_config_js, methods=["GET"], include_in_schema=False)
+
+app.add_route("/health", _StaticJSON(_HEALTH_BODY), methods=["GET"], include_in_schema=False)
+
+
+if os.getenv("DEBUG", "").lower() in ("1", "true"):
+    # Routes cannot change after import, so serialize the (path, methods) list
+    # once instead of reflecting over app.routes on every hit.
+    _ROUTES_SNAPSHOT = orjson.dumps([
+        {"path": getattr(r, "path", str(r)), "methods": sorted(getattr(r, "methods", None) or [])}
+        for r in app.routes
+    ])
     # Return list of registered routes (path + methods) for debugging
-    out = []
-    for r in app.routes:
-        methods = []
-        try:
-            methods = list(getattr(r, "methods", []) or [])
-        except Exception:
-            pass
-        out.append({"path": getattr(r, "path", str(r)), "methods": methods})
-    return out
+    app.add_route("/debug/routes", _StaticJSON(_ROUTES_SNAPSHOT), methods=["GET"], include_in_schema=False)
+
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        # uvloop is not available on Windows; fall back to the stdlib loop there
+        loop = "asyncio"
+    # WEB_CONCURRENCY > 1 runs one event loop per core. Keep it at 1 if clients
+    # rely on /api/events/stream, whose broadcaster is per-process.
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("main:app" if workers > 1 else app, host="0.0.0.0", port=8000, loop=loop, http="httptools", workers=workers)
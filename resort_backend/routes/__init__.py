@@ -1,2 +1,6 @@
-"""Routes package exports"""
-from . import accommodations, packages, experiences, wellness, bookings, home, navigation, menu_items, gallery, api_compat
+"""Route modules.
+
+Submodules are imported explicitly by main.py (or by whichever script needs
+them) rather than here, so importing a single router such as
+`routes.api_compat` doesn't pull in every other route module.
+"""
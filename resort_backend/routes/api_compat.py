@@ -2,20 +2,26 @@ from fastapi import APIRouter, Request, HTTPException, Body, Response
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from slowapi import Limiter
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from typing import Optional, List
 from datetime import datetime
-from utils import get_db_or_503, serialize_doc
+from utils import get_db_or_503, serialize_doc, base_url_prefix, NAME_COLLATION, TTLCache, parse_oid
+from routes.events import publish_event
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
 from pydantic import BaseModel
-import itertools
-import random
-import string
+import functools
 import re
-import json
+import orjson
+import base64
+import asyncio
+import hashlib
 import logging
+import os
+import time
 
-router = APIRouter(prefix="/api", tags=["api_compat"])
+router = APIRouter(prefix="/api", tags=["api_compat"], default_response_class=ORJSONResponse)
 logger = logging.getLogger(__name__)
 
 
@@ -34,126 +40,361 @@ class BookingRequest(BaseModel):
     selected_programs: Optional[List[str]] = None
     price_breakdown: Optional[dict] = None
     extra_beds_qty: Optional[int] = 0
-    extra_beds_qty: Optional[int] = 0
     # Optional single extra bed selection (compatibility) and quantity
     extraBedId: Optional[str] = None
     extraBedQuantity: Optional[int] = 0
 
-def gen_reference():
-    return "RB-" + datetime.utcnow().strftime("%Y%m%d%H%M%S") + "-" + ''.join(random.choices(string.digits, k=4))
+    class Config:
+        # Unknown client fields are dropped rather than carried on the model
+        extra = "ignore"
+
+async def gen_reference(db) -> str:
+    """Next booking reference from an atomic counter document (one round trip,
+    unique across workers, increasing)."""
+    ctr = await db["counters"].find_one_and_update(
+        {"_id": "booking_ref"},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return f"RB-{ctr['seq']:08d}"
+
+
+# Fallback filters for program documents tagged as wellness / activities.
+_WELLNESS_Q = {
+    "$or": [
+        {"type": {"$regex": "wellness", "$options": "i"}},
+        {"tags": {"$elemMatch": {"$regex": "wellness", "$options": "i"}}}
+    ]
+}
+_ACTIVITIES_Q = {
+    "$or": [
+        {"type": {"$regex": "activity|activities", "$options": "i"}},
+        {"tags": {"$elemMatch": {"$regex": "activity|activities", "$options": "i"}}}
+    ]
+}
+
+# Collection names per database handle: {id(db): (fetched_at, names)}.
+_NAMES_CACHE = {}
+
+
+async def _collection_names(db, ttl: float = 30.0) -> frozenset:
+    """Return the database's collection names, re-listing at most once per `ttl` seconds."""
+    key = id(db)
+    hit = _NAMES_CACHE.get(key)
+    now = time.monotonic()
+    if hit is not None and now - hit[0] < ttl:
+        return hit[1]
+    names = frozenset(await db.list_collection_names())
+    _NAMES_CACHE[key] = (now, names)
+    return names
+
+
+def _as_int(value, default: int = 0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
 
 
 def _room_capacity(room: dict, allow_extra_beds: bool) -> int:
-    cap = 0
     if room is None:
         return 0
+    get = room.get
+    eb = get("extra_beds")
+    if eb is None:
+        eb = get("extra_bedding")
     # Prefer explicit adults/children capacity fields if present
-    try:
-        if "capacity_adults" in room or "capacity_children" in room:
-            a = int(room.get("capacity_adults") or 0)
-            c = int(room.get("capacity_children") or 0)
-            cap = a + c
-            if allow_extra_beds:
-                eb = room.get("extra_beds") if room.get("extra_beds") is not None else room.get("extra_bedding")
-                try:
-                    cap += int(eb) if eb is not None else 0
-                except Exception:
-                    cap += 0
-            return cap
-    except Exception:
-        pass
-    if "capacity" in room and isinstance(room["capacity"], int):
-        cap = room["capacity"]
-    elif "sleeps" in room and isinstance(room["sleeps"], int):
-        cap = room["sleeps"]
-    else:
-        bc = room.get("bedConfig") or []
-        for b in bc:
-            cnt = b.get("count") or 1
-            try:
-                cap += int(cnt)
-            except Exception:
-                cap += 1
+    if "capacity_adults" in room or "capacity_children" in room:
+        cap = _as_int(get("capacity_adults") or 0) + _as_int(get("capacity_children") or 0)
+        if allow_extra_beds and eb is not None:
+            cap += _as_int(eb)
+        return cap
+    cap = get("capacity")
+    if not isinstance(cap, int):
+        cap = get("sleeps")
+    if not isinstance(cap, int):
+        cap = sum(_as_int(b.get("count") or 1, 1) for b in (get("bedConfig") or []))
     if allow_extra_beds:
-        eb = room.get("extra_beds") if room.get("extra_beds") is not None else room.get("extra_bedding")
-        if isinstance(eb, int):
-            cap += eb
-        else:
-            cap += 1
+        cap += eb if isinstance(eb, int) else 1
     return cap
 
 
-def allocate_rooms(candidates, guests: int, allow_extra_beds: bool = False, preferred_room_types=None, max_k: int = 4):
-    if guests <= 0:
-        return []
-    filtered = []
-    if preferred_room_types:
-        prefs = set([p.lower() for p in preferred_room_types])
-        for r in candidates:
-            slug = (r.get("slug") or "").lower()
-            rtype = (r.get("type") or "").lower()
-            if slug in prefs or rtype in prefs:
-                filtered.append(r)
-        if not filtered:
-            filtered = list(candidates)
-    else:
-        filtered = list(candidates)
+def _annotate_candidates(candidates, allow_extra_beds: bool, guests: int, prefs=None):
+    """Return parallel ``(caps, prices, ids)`` lists for the candidate rooms
+    plus the index of the cheapest room that alone seats `guests` (or None).
 
-    annotated = []
-    for r in filtered:
+    With `prefs`, only rooms whose slug or type is in the set are kept.
+    """
+    caps = []
+    prices = []
+    ids = []
+    best = None
+    best_price = None
+    for r in candidates:
+        if prefs and (r.get("slug") or "").lower() not in prefs and (r.get("type") or "").lower() not in prefs:
+            continue
         cap = _room_capacity(r, allow_extra_beds)
         price = r.get("price_per_night") or r.get("pricePerNight") or r.get("price") or 0
-        annotated.append({"room": r, "cap": cap, "price": price})
+        if cap >= guests and (best is None or price < best_price):
+            best = len(ids)
+            best_price = price
+        caps.append(cap)
+        prices.append(price)
+        ids.append(r["_id"])
+    return caps, prices, ids, best
 
-    singles = [a for a in annotated if a["cap"] >= guests]
-    if singles:
-        pick = min(singles, key=lambda a: a["price"])
-        return [pick["room"]["_id"]]
 
-    n = len(annotated)
-    max_k = min(max_k, n)
-    best_combo = None
-    best_k = None
-    best_price = None
-    for k in range(2, max_k + 1):
-        for combo in itertools.combinations(annotated, k):
-            cap = sum(c["cap"] for c in combo)
-            if cap >= guests:
-                price = sum(c["price"] for c in combo)
-                if best_combo is None or k < best_k or (k == best_k and price < best_price):
-                    best_combo = combo
-                    best_k = k
-                    best_price = price
-        if best_combo is not None:
-            break
-    if best_combo is not None:
-        return [c["room"]["_id"] for c in best_combo]
+# Above this many candidates allocate_rooms switches from exhaustive search to greedy.
+_EXACT_ALLOC_MAX_N = 10
+
+
+# Largest rooms x guests table _min_cover builds before allocate_rooms falls back to greedy.
+_DP_MAX_CELLS = 250_000
+
 
-    sorted_cand = sorted(annotated, key=lambda a: (-a["cap"], a["price"]))
+def _min_cover(caps, prices, guests: int):
+    """0/1 knapsack cover: the fewest rooms (then lowest price) seating `guests`.
+
+    ``best[g]`` is the best (rooms, price) seating at least `g` guests, with
+    seat counts clamped at `guests`. Runs in O(len(caps) * guests). Returns
+    the chosen indices, or None when all rooms together are too small.
+    """
+    best = [None] * (guests + 1)
+    best[0] = (0, 0)
+    # came_from[i][g]: seat count before room i was added to reach g, or -1
+    came_from = []
+    for i, cap in enumerate(caps):
+        row = [-1] * (guests + 1)
+        if cap > 0:
+            nxt = best[:]
+            for g in range(guests + 1):
+                if best[g] is None:
+                    continue
+                ng = min(guests, g + cap)
+                cand = (best[g][0] + 1, best[g][1] + prices[i])
+                if nxt[ng] is None or cand < nxt[ng]:
+                    nxt[ng] = cand
+                    row[ng] = g
+            best = nxt
+        came_from.append(row)
+    if best[guests] is None:
+        return None
+    chosen = []
+    g = guests
+    for i in range(len(caps) - 1, -1, -1):
+        if came_from[i][g] >= 0:
+            chosen.append(i)
+            g = came_from[i][g]
+    chosen.reverse()
+    return chosen
+
+
+def allocate_rooms(candidates, guests: int, allow_extra_beds: bool = False, preferred_room_types=None, max_k: int = 4):
+    if guests <= 0:
+        return []
+    prefs = {p.lower() for p in preferred_room_types} if preferred_room_types else None
+    caps, prices, ids, best = _annotate_candidates(candidates, allow_extra_beds, guests, prefs)
+    if prefs and not ids:
+        # No room matches the preferred types; consider every candidate.
+        caps, prices, ids, best = _annotate_candidates(candidates, allow_extra_beds, guests)
+    if best is not None:
+        return [ids[best]]
+    n = len(ids)
+
+    # A subset of at most max_k rooms never needs more than max_k rooms of one
+    # capacity, and swapping in a cheaper room of equal capacity never hurts,
+    # so only the max_k cheapest rooms per capacity can appear in an optimum.
+    # Inventories of many identical rooms collapse to a handful of candidates.
+    pool = []
+    per_cap = {}
+    for i in sorted(range(n), key=lambda i: (caps[i], prices[i])):
+        if per_cap.get(caps[i], 0) < max_k:
+            per_cap[caps[i]] = per_cap.get(caps[i], 0) + 1
+            pool.append(i)
+
+    if len(pool) <= _EXACT_ALLOC_MAX_N:
+        # Few candidates: exhaustive search gives the fewest-rooms /
+        # lowest-price optimum. Subsets are bitmasks whose capacity, price and
+        # size each extend the mask with its lowest bit cleared, so every
+        # subset costs O(1) instead of re-summing its members.
+        m = len(pool)
+        size = 1 << m
+        cap_sum = [0] * size
+        price_sum = [0] * size
+        count = [0] * size
+        best_mask = 0
+        for mask in range(1, size):
+            rest = mask & (mask - 1)
+            i = pool[(mask ^ rest).bit_length() - 1]
+            cap_sum[mask] = cap_sum[rest] + caps[i]
+            price_sum[mask] = price_sum[rest] + prices[i]
+            k = count[mask] = count[rest] + 1
+            if k < 2 or k > max_k or cap_sum[mask] < guests:
+                continue
+            if not best_mask or (k, price_sum[mask]) < (count[best_mask], price_sum[best_mask]):
+                best_mask = mask
+        if best_mask:
+            return [ids[pool[j]] for j in range(m) if best_mask >> j & 1]
+
+    if n * guests <= _DP_MAX_CELLS:
+        chosen = _min_cover(caps, prices, guests)
+        return [ids[i] for i in chosen] if chosen is not None else []
+
+    # Greedy: repeatedly take the room that seats the most of the remaining
+    # guests per unit price. O(n^2) instead of O(C(n, k)).
+    pool = sorted(range(n), key=lambda i: (-caps[i], prices[i]))
     picked = []
-    total = 0
-    for a in sorted_cand:
-        if total >= guests:
+    remaining = guests
+    while remaining > 0 and pool:
+        best_j = None
+        best_score = None
+        for j, i in enumerate(pool):
+            useful = min(caps[i], remaining)
+            if useful <= 0:
+                continue
+            score = useful / prices[i] if prices[i] else float("inf")
+            if best_score is None or score > best_score:
+                best_j = j
+                best_score = score
+        if best_j is None:
             break
-        picked.append(a["room"]["_id"])
-        total += a["cap"]
-    if total < guests:
+        i = pool.pop(best_j)
+        picked.append(ids[i])
+        remaining -= caps[i]
+    if remaining > 0:
         return []
     return picked
 
 
+# Constant payload: encode it and its ETag once at import.
+_SITE_CONFIG_BODY = b"window.__SITE_CONFIG__ = " + orjson.dumps({"apiBase": "/api", "siteName": "Resort"}) + b";"
+_SITE_CONFIG_ETAG = '"' + hashlib.md5(_SITE_CONFIG_BODY).hexdigest() + '"'
+_SITE_CONFIG_HEADERS = {"ETag": _SITE_CONFIG_ETAG, "Cache-Control": "public, max-age=3600"}
+
+
 @router.get("/site/site-config.js")
-async def site_config_js():
-    config = {"apiBase": "/api", "siteName": "Resort"}
-    body = "window.__SITE_CONFIG__ = " + json.dumps(config) + ";"
-    return Response(content=body, media_type="application/javascript")
+async def site_config_js(request: Request):
+    """Tiny JS snippet used by the frontend dev toolbar; also served at
+    /site/site-config.js from main.py."""
+    if request.headers.get("if-none-match") == _SITE_CONFIG_ETAG:
+        return Response(status_code=304, headers=_SITE_CONFIG_HEADERS)
+    return Response(content=_SITE_CONFIG_BODY, media_type="application/javascript", headers=_SITE_CONFIG_HEADERS)
+
+
+# Fields returned by the /cottages listing. Full documents are served by /cottages/{id}.
+_ROOM_LIST_PROJECTION = {
+    "_id": 1, "id": 1, "slug": 1, "name": 1, "title": 1, "type": 1, "description": 1, "tags": 1,
+    "amenities": 1, "rating": 1, "price_per_night": 1, "pricePerNight": 1, "price": 1,
+    "images": 1, "media": 1, "capacity": 1, "capacity_adults": 1, "capacity_children": 1,
+    "sleeps": 1, "bedConfig": 1, "available": 1, "extra_beds": 1, "extra_bedding": 1,
+    "extra_bedding_price": 1, "extraBedAllowed": 1, "extra_bed_allowed": 1,
+    "allowedExtraBedIds": 1, "allowed_extra_bed_ids": 1, "allowedExtraBeds": 1,
+    "accommodation_id": 1, "accommodation_slug": 1, "accommodation_name": 1,
+}
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _unb64(token: str) -> bytes:
+    return base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+
+
+def _encode_cursor(_id) -> str:
+    """Keyset token for a room `_id`: the 12 ObjectId bytes, or "~" plus the
+    string for rooms with string ids ("~" is outside the base64 alphabet)."""
+    if isinstance(_id, ObjectId):
+        return _b64(_id.binary)
+    return "~" + _b64(str(_id).encode())
+
+
+def _cursor_filter(token: str) -> Optional[dict]:
+    """`_id` filter for rooms after `token` in _id order, or None if invalid."""
+    try:
+        if token.startswith("~"):
+            # Strings sort before ObjectIds in BSON order, so every ObjectId
+            # room is still ahead of a string position.
+            sid = _unb64(token[1:]).decode()
+            return {"$or": [{"_id": {"$gt": sid}}, {"_id": {"$type": "objectId"}}]}
+        return {"_id": {"$gt": ObjectId(_unb64(token))}}
+    except Exception:
+        return None
+
+
+def _map_price(out: dict):
+    if out.get("pricePerNight") is not None and out.get("price_per_night") is None:
+        out["price_per_night"] = out.get("pricePerNight")
+    if out.get("price") is not None and out.get("price_per_night") is None:
+        out["price_per_night"] = out.get("price")
+
+
+def _map_images(out: dict):
+    if out.get("images") is None and out.get("media") is not None:
+        out["images"] = out.get("media")
+
+
+def _map_sleeps(out: dict):
+    if out.get("capacity") is None and out.get("sleeps") is not None:
+        out["capacity"] = out.get("sleeps")
+
+
+def _map_capacity(out: dict):
+    # expose explicit adult/child capacity when available
+    if out.get("capacity_adults") is not None or out.get("capacity_children") is not None:
+        out["capacity_adults"] = out.get("capacity_adults") if out.get("capacity_adults") is not None else (out.get("capacity") or out.get("sleeps") or 0)
+        out["capacity_children"] = out.get("capacity_children") if out.get("capacity_children") is not None else 0
+        out["capacity"] = int(out.get("capacity_adults") or 0) + int(out.get("capacity_children") or 0)
+    else:
+        _map_sleeps(out)
+
+
+def _map_available(out: dict):
+    if out.get("available") is None:
+        out["available"] = True
+
+
+def _map_extra_beds(out: dict):
+    # admin-controlled extra bed flags (compatibility mapping)
+    out["extraBedAllowed"] = out.get("extraBedAllowed") or out.get("extra_bed_allowed") or False
+    out["allowedExtraBedIds"] = out.get("allowedExtraBedIds") or out.get("allowed_extra_bed_ids") or out.get("allowedExtraBeds") or None
+
+
+@functools.lru_cache(maxsize=64)
+def _transformer(keyset: frozenset):
+    """Build the public room mapper for documents with exactly these keys.
+
+    Mappings whose source fields are absent from the key set are skipped, so
+    rooms sharing a schema only pay for the checks that can apply to them.
+    """
+    steps = []
+    if "pricePerNight" in keyset or "price" in keyset:
+        steps.append(_map_price)
+    if "media" in keyset:
+        steps.append(_map_images)
+    if "capacity_adults" in keyset or "capacity_children" in keyset:
+        steps.append(_map_capacity)
+    elif "sleeps" in keyset:
+        steps.append(_map_sleeps)
+    steps.append(_map_available)
+    steps.append(_map_extra_beds)
+    steps = tuple(steps)
+
+    def transform(r: dict) -> dict:
+        out = serialize_doc(r)
+        for step in steps:
+            step(out)
+        return out
+
+    return transform
 
 
 @router.get("/cottages")
 async def cottages_list(request: Request, page: int = 1, limit: int = 20, tags: Optional[str] = None,
                         minCapacity: Optional[int] = None, maxPrice: Optional[float] = None,
                         availableStart: Optional[str] = None, availableEnd: Optional[str] = None,
-                        sort: Optional[str] = None):
+                        sort: Optional[str] = None, after: Optional[str] = None):
     db = get_db_or_503(request)
     # Primary data source for cottages is the `rooms` collection. Return rooms as first-class resources.
     q = {}
@@ -165,55 +406,83 @@ async def cottages_list(request: Request, page: int = 1, limit: int = 20, tags:
         q["price_per_night"] = {"$lte": maxPrice}
 
     skip = (page - 1) * limit
+    # Availability is filtered server-side: rooms join their overlapping
+    # confirmed/pending bookings and only rooms with none are kept.
+    avail_stages = []
     if availableStart and availableEnd:
         try:
             s = datetime.strptime(availableStart, "%Y-%m-%d")
             e = datetime.strptime(availableEnd, "%Y-%m-%d")
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid date format; use YYYY-MM-DD")
-        busy_room_ids = await db["bookings"].distinct("allocated_cottages", {
-            "status": {"$in": ["confirmed", "pending"]},
-            "check_in": {"$lt": e},
-            "check_out": {"$gt": s}
-        })
-        busy_room_ids = [b for b in busy_room_ids if b]
-        if busy_room_ids:
-            q["_id"] = {"$nin": busy_room_ids}
+        avail_stages = [
+            {"$lookup": {
+                "from": "bookings",
+                "let": {"rid": "$_id"},
+                "pipeline": [
+                    {"$match": {
+                        "status": {"$in": ["confirmed", "pending"]},
+                        "check_in": {"$lt": e},
+                        "check_out": {"$gt": s},
+                        "$expr": {"$in": ["$$rid", {"$ifNull": ["$allocated_cottages", []]}]},
+                    }},
+                    {"$limit": 1},
+                    {"$project": {"_id": 1}},
+                ],
+                "as": "_busy",
+            }},
+            {"$match": {"_busy": {"$size": 0}}},
+            {"$project": {"_busy": 0}},
+        ]
 
+    if after is not None:
+        # Cursor mode: seek past the last seen _id instead of skipping, so deep
+        # pages cost the same as the first. An empty token starts from the top.
+        # Pages are in _id order, so a price sort can't be combined with it.
+        if sort:
+            raise HTTPException(status_code=400, detail="sort is not supported with after")
+        if after:
+            seek = _cursor_filter(after)
+            if seek is None:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            q.update(seek)
+        try:
+            if avail_stages:
+                pipeline = [{"$match": q}, {"$sort": {"_id": 1}}] + avail_stages + [{"$limit": limit + 1}, {"$project": _ROOM_LIST_PROJECTION}]
+                items = await (await db["rooms"].aggregate(pipeline)).to_list(limit + 1)
+            else:
+                items = await db["rooms"].find(q, _ROOM_LIST_PROJECTION).sort([("_id", 1)]).limit(limit + 1).to_list(length=limit + 1)
+        except Exception:
+            raise HTTPException(status_code=500, detail="Failed to query rooms collection")
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = _encode_cursor(items[-1]["_id"])
+        return {"limit": limit, "nextCursor": next_cursor, "items": [_transformer(frozenset(i))(i) for i in items]}
+
+    # One round trip for both the page and the total via $facet.
+    page_stages = []
+    if sort == "price-asc":
+        page_stages.append({"$sort": {"price_per_night": 1}})
+    elif sort == "price-desc":
+        page_stages.append({"$sort": {"price_per_night": -1}})
+    if skip > 0:
+        page_stages.append({"$skip": skip})
+    if limit > 0:
+        page_stages.append({"$limit": limit})
+    page_stages.append({"$project": _ROOM_LIST_PROJECTION})
+    pipeline = [{"$match": q}] + avail_stages + [
+        {"$facet": {"items": page_stages, "total": [{"$count": "n"}]}},
+    ]
     try:
-        cursor = db["rooms"].find(q)
-        total = await db["rooms"].count_documents(q)
-        if sort == "price-asc":
-            cursor = cursor.sort([("price_per_night", 1)])
-        elif sort == "price-desc":
-            cursor = cursor.sort([("price_per_night", -1)])
-        items = await cursor.skip(skip).limit(limit).to_list(length=limit)
+        facet = await (await db["rooms"].aggregate(pipeline)).to_list(1)
+        items = facet[0]["items"] if facet else []
+        counted = facet[0]["total"] if facet else []
+        total = counted[0]["n"] if counted else 0
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to query rooms collection")
 
-    def room_to_public(r: dict):
-        out = serialize_doc(r)
-        if out.get("pricePerNight") is not None and out.get("price_per_night") is None:
-            out["price_per_night"] = out.get("pricePerNight")
-        if out.get("price") is not None and out.get("price_per_night") is None:
-            out["price_per_night"] = out.get("price")
-        if out.get("images") is None and out.get("media") is not None:
-            out["images"] = out.get("media")
-        # expose explicit adult/child capacity when available
-        if out.get("capacity_adults") is not None or out.get("capacity_children") is not None:
-            out["capacity_adults"] = out.get("capacity_adults") if out.get("capacity_adults") is not None else (out.get("capacity") or out.get("sleeps") or 0)
-            out["capacity_children"] = out.get("capacity_children") if out.get("capacity_children") is not None else 0
-            out["capacity"] = int(out.get("capacity_adults") or 0) + int(out.get("capacity_children") or 0)
-        elif out.get("capacity") is None and out.get("sleeps") is not None:
-            out["capacity"] = out.get("sleeps")
-        if out.get("available") is None:
-            out["available"] = True
-        # admin-controlled extra bed flags (compatibility mapping)
-        out["extraBedAllowed"] = out.get("extraBedAllowed") or out.get("extra_bed_allowed") or False
-        out["allowedExtraBedIds"] = out.get("allowedExtraBedIds") or out.get("allowed_extra_bed_ids") or out.get("allowedExtraBeds") or None
-        return out
-
-    out_items = [room_to_public(i) for i in items]
+    out_items = [_transformer(frozenset(i))(i) for i in items]
     return {"page": page, "limit": limit, "total": total, "items": out_items}
 
 
@@ -241,6 +510,72 @@ async def dining_ensure(request: Request):
     return {"ok": True}
 
 
+# Fields read by _public_program / _public_activity; everything else stays on the server.
+_PROGRAM_PROJECTION = {
+    "title": 1, "name": 1, "programName": 1, "description": 1, "summary": 1, "details": 1,
+    "duration": 1, "duration_days": 1, "length": 1, "price": 1, "price_inr": 1, "cost": 1,
+    "amount": 1, "image": 1, "images": 1, "media": 1,
+}
+_ACTIVITY_PROJECTION = {
+    "title": 1, "name": 1, "description": 1, "summary": 1, "schedule": 1, "time": 1,
+    "location": 1, "price": 1, "imageUrl": 1, "image": 1, "images": 1, "media": 1, "id": 1,
+}
+
+
+def _public_program(d: dict, base: Optional[str] = None) -> dict:
+    """Map a wellness/activity program document to the public card schema.
+
+    When `base` is given, a root-relative image path is prefixed with it.
+    """
+    try:
+        doc = serialize_doc(d)
+    except Exception:
+        doc = dict(d)
+    title = doc.get("title") or doc.get("name") or doc.get("programName") or ""
+    description = doc.get("description") or doc.get("summary") or doc.get("details") or ""
+    duration = doc.get("duration") or (str(doc.get("duration_days")) + " days" if doc.get("duration_days") else doc.get("length") or "")
+    price = doc.get("price") or doc.get("price_inr") or doc.get("cost") or doc.get("amount") or 0
+    # normalize numeric
+    try:
+        if isinstance(price, (float, int)):
+            price_val = int(price)
+        else:
+            price_val = int(float(str(price)))
+    except Exception:
+        price_val = 0
+    image = doc.get("image")
+    if not image:
+        imgs = doc.get("images") or doc.get("media") or []
+        if isinstance(imgs, list) and len(imgs) > 0:
+            image = imgs[0]
+    if base and image and isinstance(image, str) and image.startswith("/"):
+        image = base + image
+    return {
+        "title": title,
+        "description": description,
+        "duration": duration,
+        "price": price_val,
+        "image": image,
+    }
+
+
+def _public_activity(d: dict) -> dict:
+    """Map an `activities` document to the simplified public activity schema."""
+    try:
+        doc = serialize_doc(d)
+    except Exception:
+        doc = dict(d)
+    return {
+        "title": doc.get("title") or doc.get("name") or "",
+        "description": doc.get("description") or doc.get("summary") or "",
+        "schedule": doc.get("schedule") or doc.get("time") or "",
+        "location": doc.get("location") or "",
+        "price": doc.get("price") or 0,
+        "imageUrl": doc.get("imageUrl") or doc.get("image") or (doc.get("images") or (doc.get("media") or []) ) and ( (doc.get("images") or (doc.get("media") or []) )[0] if isinstance((doc.get("images") or (doc.get("media") or [])), list) and len((doc.get("images") or (doc.get("media") or [])))>0 else None),
+        "id": doc.get("id") or doc.get("_id")
+    }
+
+
 @router.get("/programs")
 async def programs_list(request: Request):
     db = get_db_or_503(request)
@@ -249,78 +584,28 @@ async def programs_list(request: Request):
     tag = request.query_params.get('tag') if request.query_params else None
     if tag:
         t = tag.lower()
-        if t == 'wellness':
-            try:
-                names = await db.list_collection_names()
-            except Exception:
-                raise HTTPException(status_code=500, detail="Failed to list collections")
-
-        async def map_doc_local(d: dict):
+        if "wellnessPrograms" in (await _collection_names(db)):
             try:
-                doc = serialize_doc(d)
-            except Exception:
-                doc = dict(d)
-            title = doc.get("title") or doc.get("name") or doc.get("programName") or ""
-            description = doc.get("description") or doc.get("summary") or doc.get("details") or ""
-            duration = doc.get("duration") or (str(doc.get("duration_days")) + " days" if doc.get("duration_days") else doc.get("length") or "")
-            price = doc.get("price") or doc.get("price_inr") or doc.get("cost") or doc.get("amount") or 0
-            try:
-                if isinstance(price, (float, int)):
-                    price_val = int(price)
-                else:
-                    price_val = int(float(str(price)))
-            except Exception:
-                price_val = 0
-            image = doc.get("image")
-            if not image:
-                imgs = doc.get("images") or doc.get("media") or []
-                if isinstance(imgs, list) and len(imgs) > 0:
-                    image = imgs[0]
-            return {
-                "title": title,
-                "description": description,
-                "duration": duration,
-                "price": price_val,
-                "image": image,
-            }
-
-        if "wellnessPrograms" in (await db.list_collection_names()):
-            try:
-                docs = await db["wellnessPrograms"].find().to_list(None)
+                docs = await db["wellnessPrograms"].find({}, _PROGRAM_PROJECTION).to_list(None)
             except Exception:
                 raise HTTPException(status_code=500, detail="Failed to query wellnessPrograms")
-            out = [await map_doc_local(d) for d in docs]
+            out = list(map(_public_program, docs))
             return {"value": out, "Count": len(out)}
             # Fallback: continue to normal behavior below if wellnessPrograms not present
         if t in ('activities', 'resort-activities'):
             # Return activities collection in a simplified public form
-            async def map_activity(d: dict):
+            if "activities" in (await _collection_names(db)):
                 try:
-                    doc = serialize_doc(d)
-                except Exception:
-                    doc = dict(d)
-                return {
-                    "title": doc.get("title") or doc.get("name") or "",
-                    "description": doc.get("description") or doc.get("summary") or "",
-                    "schedule": doc.get("schedule") or doc.get("time") or "",
-                    "location": doc.get("location") or "",
-                    "price": doc.get("price") or 0,
-                    "imageUrl": doc.get("imageUrl") or doc.get("image") or (doc.get("images") or (doc.get("media") or []) ) and ( (doc.get("images") or (doc.get("media") or []) )[0] if isinstance((doc.get("images") or (doc.get("media") or [])), list) and len((doc.get("images") or (doc.get("media") or [])))>0 else None),
-                    "id": doc.get("id") or doc.get("_id")
-                }
-
-            if "activities" in (await db.list_collection_names()):
-                try:
-                    docs = await db["activities"].find().to_list(None)
+                    docs = await db["activities"].find({}, _ACTIVITY_PROJECTION).to_list(None)
                 except Exception:
                     raise HTTPException(status_code=500, detail="Failed to query activities")
-                out = [await map_activity(d) for d in docs]
+                out = list(map(_public_activity, docs))
                 return out
             # else fallthrough to normal behavior
 
     # Try to return from `programs` if present; else combine wellnessPrograms + activities
     try:
-        names = await db.list_collection_names()
+        names = await _collection_names(db)
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to list collections")
 
@@ -333,10 +618,18 @@ async def programs_list(request: Request):
     res = await fetch("programs")
     if res:
         return res
-    combined = []
-    combined += await fetch("wellnessPrograms")
-    combined += await fetch("activities")
-    return combined
+    # wellnessPrograms followed by activities in a single round trip. Missing
+    # collections read as empty on either side of $unionWith.
+    try:
+        cursor = await db["wellnessPrograms"].aggregate([{"$unionWith": {"coll": "activities"}}])
+        docs = await cursor.to_list(None)
+    except OperationFailure:
+        # Servers older than MongoDB 4.4 don't know $unionWith.
+        combined = []
+        combined += await fetch("wellnessPrograms")
+        combined += await fetch("activities")
+        return combined
+    return [serialize_doc(d) for d in docs]
 
 
 
@@ -344,50 +637,45 @@ async def programs_list(request: Request):
 async def sitemap_xml(request: Request):
     """Dynamic sitemap generated from accommodations and rooms collections."""
     db = get_db_or_503(request)
-    frontend = os.environ.get('FRONTEND_URL') or str(request.base_url).rstrip('/')
-    urls = []
-    try:
-        accs = await db['accommodations'].find().to_list(length=None)
-        for a in accs:
-            s = a.get('slug') or a.get('id') or (str(a.get('_id')) if a.get('_id') else None)
-            if s:
-                urls.append(f"{frontend}/rooms/{s}")
-    except Exception:
-        pass
-    try:
-        rooms = await db['rooms'].find().to_list(length=None)
-        for r in rooms:
-            s = r.get('slug') or r.get('id') or (str(r.get('_id')) if r.get('_id') else None)
-            if s:
-                urls.append(f"{frontend}/rooms/{s}")
-    except Exception:
-        pass
+    frontend = os.environ.get('FRONTEND_URL') or base_url_prefix(request)
+
+    proj = {'slug': 1, 'id': 1, '_id': 1}
+
+    async def gen():
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        # dedupe on the slug only, preserving first-seen order
+        seen = set()
+        # Documents are read from the projected cursors as the response is
+        # sent, one batch at a time; a failing collection just stops adding
+        # URLs, as before.
+        for coll in ('accommodations', 'rooms'):
+            cursor = db[coll].find({}, proj)
+            try:
+                async for doc in cursor:
+                    s = doc.get('slug') or doc.get('id') or (str(doc.get('_id')) if doc.get('_id') else None)
+                    if s and s not in seen:
+                        seen.add(s)
+                        yield (
+                            '  <url>\n'
+                            f'    <loc>{frontend}/rooms/{s}</loc>\n'
+                            '    <changefreq>weekly</changefreq>\n'
+                            '    <priority>0.8</priority>\n'
+                            '  </url>\n'
+                        )
+            except Exception:
+                logger.warning("sitemap: reading %s failed", coll, exc_info=True)
+            finally:
+                await cursor.close()
+        yield '</urlset>'
 
-    # dedupe preserving order
-    seen = set()
-    unique = []
-    for u in urls:
-        if u not in seen:
-            seen.add(u)
-            unique.append(u)
-
-    xml_parts = ['<?xml version="1.0" encoding="UTF-8"?>', '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
-    for u in unique:
-        xml_parts.append('  <url>')
-        xml_parts.append(f'    <loc>{u}</loc>')
-        xml_parts.append('    <changefreq>weekly</changefreq>')
-        xml_parts.append('    <priority>0.8</priority>')
-        xml_parts.append('  </url>')
-    xml_parts.append('</urlset>')
-    from fastapi.responses import Response
-    return Response('\n'.join(xml_parts), media_type='application/xml')
+    return StreamingResponse(gen(), media_type='application/xml')
 
 
 @router.get("/programs/wellness")
 async def programs_wellness(request: Request):
     db = get_db_or_503(request)
     try:
-        names = await db.list_collection_names()
+        names = await _collection_names(db)
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to list collections")
 
@@ -396,68 +684,43 @@ async def programs_wellness(request: Request):
     # a non-production environment (ENVIRONMENT != 'production'). This allows
     # local frontend dev servers to call `/api/programs/wellness` without
     # injecting secrets into the client.
-    import os
     # This compatibility endpoint intentionally does not enforce the API key.
     # API key enforcement is available on stricter endpoints; keep this route
     # open for development clients to avoid embedding secrets in the frontend.
 
-    async def map_doc(d: dict):
-        # Map document fields to expected public schema
-        try:
-            doc = serialize_doc(d)
-        except Exception:
-            doc = dict(d)
-        title = doc.get("title") or doc.get("name") or doc.get("programName") or ""
-        description = doc.get("description") or doc.get("summary") or doc.get("details") or ""
-        duration = doc.get("duration") or (str(doc.get("duration_days")) + " days" if doc.get("duration_days") else doc.get("length") or "")
-        price = doc.get("price") or doc.get("price_inr") or doc.get("cost") or doc.get("amount") or 0
-        # normalize numeric
-        try:
-            if isinstance(price, (float, int)):
-                price_val = int(price)
-            else:
-                price_val = int(float(str(price)))
-        except Exception:
-            price_val = 0
-        image = doc.get("image")
-        if not image:
-            imgs = doc.get("images") or doc.get("media") or []
-            if isinstance(imgs, list) and len(imgs) > 0:
-                image = imgs[0]
-        return {
-            "title": title,
-            "description": description,
-            "duration": duration,
-            "price": price_val,
-            "image": image,
-        }
-
     # Prefer wellnessPrograms collection if it exists
     if "wellnessPrograms" in names:
         try:
-            docs = await db["wellnessPrograms"].find().to_list(None)
+            docs = await db["wellnessPrograms"].find({}, _PROGRAM_PROJECTION).to_list(None)
         except Exception:
             raise HTTPException(status_code=500, detail="Failed to query wellnessPrograms")
-        out = []
-        for d in docs:
-            out.append(await map_doc(d))
+        out = list(map(_public_program, docs))
         return {"value": out, "Count": len(out)}
 
     # Fallback: match documents in `programs` with wellness type/tags
-    q = {
-        "$or": [
-            {"type": {"$regex": "wellness", "$options": "i"}},
-            {"tags": {"$elemMatch": {"$regex": "wellness", "$options": "i"}}}
-        ]
-    }
     try:
-        docs = await db["programs"].find(q).to_list(None)
+        docs = await db["programs"].find(_WELLNESS_Q, _PROGRAM_PROJECTION).to_list(None)
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to query programs collection")
-    out = [await map_doc(d) for d in docs]
+    out = list(map(_public_program, docs))
     return {"value": out, "Count": len(out)}
 
 
+def _acc_key(value):
+    """Match condition for a room's `accommodation_id`.
+
+    Ids may be stored as an ObjectId or as its hex string (the
+    MIGRATE_ACCOMMODATION_IDS step that normalises them is opt-in), so
+    ObjectId-shaped values match either form, like the booking routes do.
+    """
+    if not isinstance(value, ObjectId):
+        value = str(value)
+        if not ObjectId.is_valid(value):
+            return value
+        value = parse_oid(value)
+    return {"$in": [value, str(value)]}
+
+
 @router.get("/cottages/{cottage_id}")
 async def cottages_get(request: Request, cottage_id: str):
     db = get_db_or_503(request)
@@ -467,7 +730,7 @@ async def cottages_get(request: Request, cottage_id: str):
         try:
             if cottage_id and ObjectId.is_valid(cottage_id):
                 try:
-                    d = await db[coll_name].find_one({"_id": ObjectId(cottage_id)})
+                    d = await db[coll_name].find_one({"_id": parse_oid(cottage_id)})
                     if d:
                         return d
                 except Exception:
@@ -488,7 +751,7 @@ async def cottages_get(request: Request, cottage_id: str):
         except Exception:
             pass
         try:
-            d = await db[coll_name].find_one({"name": {"$regex": f"^{cottage_id}$", "$options": "i"}})
+            d = await db[coll_name].find_one({"name": cottage_id}, collation=NAME_COLLATION)
             if d:
                 return d
         except Exception:
@@ -500,7 +763,7 @@ async def cottages_get(request: Request, cottage_id: str):
     room_q = None
     try:
         if cottage_id and ObjectId.is_valid(cottage_id):
-            room_q = {"_id": ObjectId(cottage_id)}
+            room_q = {"_id": parse_oid(cottage_id)}
             room = await db["rooms"].find_one(room_q)
             if room:
                 out = serialize_doc(room)
@@ -522,7 +785,7 @@ async def cottages_get(request: Request, cottage_id: str):
     except Exception:
         pass
     try:
-        room = await db["rooms"].find_one({"name": {"$regex": f"^{cottage_id}$", "$options": "i"}})
+        room = await db["rooms"].find_one({"name": cottage_id}, collation=NAME_COLLATION)
         if room:
             return serialize_doc(room)
     except Exception:
@@ -530,15 +793,10 @@ async def cottages_get(request: Request, cottage_id: str):
 
     # If no single room matched, see if there are rooms that belong to an accommodation
     try:
-        # try by accommodation_id equal to ObjectId or string
-        rooms_by_acc = []
-        if ObjectId.is_valid(cottage_id):
-            rooms_by_acc = await db["rooms"].find({"accommodation_id": ObjectId(cottage_id)}).to_list(length=None)
-        if not rooms_by_acc:
-            rooms_by_acc = await db["rooms"].find({"accommodation_id": str(cottage_id)}).to_list(length=None)
-        # also try rooms where accommodation slug/id stored in room fields
+        rooms_by_acc = await db["rooms"].find({"accommodation_id": _acc_key(cottage_id)}).to_list(length=None)
+        # also try rooms where the accommodation slug is stored on the room
         if not rooms_by_acc:
-            rooms_by_acc = await db["rooms"].find({"$or": [{"accommodation_slug": cottage_id}, {"accommodation_id": cottage_id}]}).to_list(length=None)
+            rooms_by_acc = await db["rooms"].find({"accommodation_slug": cottage_id}).to_list(length=None)
         if rooms_by_acc:
             # build accommodation-like response from rooms
             rooms_out = [serialize_doc(r) for r in rooms_by_acc]
@@ -562,7 +820,7 @@ async def cottages_get(request: Request, cottage_id: str):
     if not out.get("rooms"):
         out["rooms"] = []
     try:
-        rooms_cursor = db["rooms"].find({"$or": [{"accommodation_id": out.get("_id")}, {"accommodation_id": str(out.get("_id"))}]})
+        rooms_cursor = db["rooms"].find({"accommodation_id": _acc_key(doc.get("_id"))})
         rooms = await rooms_cursor.to_list(length=None)
         if rooms:
             out["rooms"] = [serialize_doc(r) for r in rooms]
@@ -574,30 +832,27 @@ async def cottages_get(request: Request, cottage_id: str):
 @router.get("/rooms/name/{room_name}")
 async def rooms_get_by_name(request: Request, room_name: str):
     db = get_db_or_503(request)
-    # try combined $or lookup to match name, slug, id, or _id
-    query = {
-        "$or": [
-            {"name": {"$regex": f"^{re.escape(room_name)}$", "$options": "i"}},
-            {"slug": room_name},
-            {"id": room_name},
-            {"_id": room_name}
-        ]
-    }
+    # Exact slug/id/_id match first, then a case-insensitive name match that
+    # can use the `rooms_name_ci` collation index.
     try:
-        doc = await db["rooms"].find_one(query)
+        doc = await db["rooms"].find_one({"$or": [{"slug": room_name}, {"id": room_name}, {"_id": room_name}]})
+        if not doc:
+            doc = await db["rooms"].find_one({"name": room_name}, collation=NAME_COLLATION)
     except Exception:
         doc = None
 
     if not doc:
         # try accommodations fallback where an accommodation matches the slug/id/name
         try:
-            acc = await db["accommodations"].find_one({"$or": [{"slug": room_name}, {"id": room_name}, {"name": {"$regex": f"^{re.escape(room_name)}$", "$options": "i"}}]})
+            acc = await db["accommodations"].find_one({"$or": [{"slug": room_name}, {"id": room_name}]})
+            if not acc:
+                acc = await db["accommodations"].find_one({"name": room_name}, collation=NAME_COLLATION)
         except Exception:
             acc = None
         if acc:
             a = serialize_doc(acc)
             try:
-                rooms_cursor = db["rooms"].find({"$or": [{"accommodation_id": acc.get("_id")}, {"accommodation_id": str(acc.get("_id"))}]})
+                rooms_cursor = db["rooms"].find({"accommodation_id": _acc_key(acc.get("_id"))})
                 rooms = await rooms_cursor.to_list(length=None)
                 a["rooms"] = [serialize_doc(r) for r in rooms] if rooms else []
             except Exception:
@@ -620,149 +875,79 @@ async def rooms_get_by_name(request: Request, room_name: str):
     out["allowedExtraBedIds"] = out.get("allowedExtraBedIds") or out.get("allowed_extra_bed_ids") or out.get("allowedExtraBeds") or None
     return out
 
-    # If not found in rooms, try accommodations collection (some datasets store items there)
-    try:
-        acc = await db["accommodations"].find_one({"$or": [
-            {"slug": room_name},
-            {"id": room_name},
-            {"name": {"$regex": f"^{room_name}$", "$options": "i"}}
-        ]})
-    except Exception:
-        acc = None
-
-    if acc:
-        # normalize accommodation document to a room-like response the frontend expects
-        a = serialize_doc(acc)
-        # attach any per-accommodation rooms
-        try:
-            rooms_cursor = db["rooms"].find({"$or": [{"accommodation_id": acc.get("_id")}, {"accommodation_id": str(acc.get("_id"))}]})
-            rooms = await rooms_cursor.to_list(length=None)
-            if rooms:
-                a["rooms"] = [serialize_doc(r) for r in rooms]
-            else:
-                a.setdefault("rooms", [])
-        except Exception:
-            a.setdefault("rooms", [])
-        return a
-
-    raise HTTPException(status_code=404, detail="Not found")
-
-
-@router.get("/dining")
-async def dining_menu(request: Request):
-    db = get_db_or_503(request)
-    docs = await db["menu"].find().to_list(None)
-    return [serialize_doc(d) for d in docs]
-
-
-@router.post("/dining/ensure")
-async def dining_ensure(request: Request):
-    db = get_db_or_503(request)
-    # Simple ensure: if menu empty, copy from menu_items
-    cnt = await db["menu"].count_documents({})
-    if cnt == 0:
-        items = await db["menu_items"].find().to_list(None)
-        if items:
-            for it in items:
-                it.pop("_id", None)
-            await db["menu"].insert_many(items)
-    return {"ok": True}
-
-
-@router.get("/programs")
-async def programs_list(request: Request):
-    db = get_db_or_503(request)
-    # Try to return from `programs` if present; else combine wellnessPrograms + activities
-    try:
-        names = await db.list_collection_names()
-    except Exception:
-        raise HTTPException(status_code=500, detail="Failed to list collections")
-
-    async def fetch(name: str):
-        if name in names:
-            docs = await db[name].find().to_list(None)
-            return [serialize_doc(d) for d in docs]
-        return []
-
-    res = await fetch("programs")
-    if res:
-        return res
-    combined = []
-    combined += await fetch("wellnessPrograms")
-    combined += await fetch("activities")
-    return combined
-
-
-
-
 
 @router.get("/programs/activities")
 async def programs_activities(request: Request):
     db = get_db_or_503(request)
     try:
-        names = await db.list_collection_names()
+        names = await _collection_names(db)
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to list collections")
-    async def map_doc(d: dict):
-        try:
-            doc = serialize_doc(d)
-        except Exception:
-            doc = dict(d)
-        title = doc.get("title") or doc.get("name") or doc.get("programName") or ""
-        description = doc.get("description") or doc.get("summary") or doc.get("details") or ""
-        duration = doc.get("duration") or (str(doc.get("duration_days")) + " days" if doc.get("duration_days") else doc.get("length") or "")
-        price = doc.get("price") or doc.get("price_inr") or doc.get("cost") or doc.get("amount") or 0
-        try:
-            if isinstance(price, (float, int)):
-                price_val = int(price)
-            else:
-                price_val = int(float(str(price)))
-        except Exception:
-            price_val = 0
-        image = doc.get("image")
-        if not image:
-            imgs = doc.get("images") or doc.get("media") or []
-            if isinstance(imgs, list) and len(imgs) > 0:
-                image = imgs[0]
-        # If image is a relative path, prefix with backend base URL so frontend loads from backend
-        try:
-            if image and isinstance(image, str) and image.startswith("/"):
-                base = str(request.base_url).rstrip("/")
-                image = base + image
-        except Exception:
-            pass
-        return {
-            "title": title,
-            "description": description,
-            "duration": duration,
-            "price": price_val,
-            "image": image,
-        }
+    # Relative image paths are served by this backend; make them absolute for the frontend
+    base = base_url_prefix(request)
 
     # Prefer activities collection if it exists
     if "activities" in names:
         try:
-            docs = await db["activities"].find().to_list(None)
+            docs = await db["activities"].find({}, _PROGRAM_PROJECTION).to_list(None)
         except Exception:
             raise HTTPException(status_code=500, detail="Failed to query activities")
-        out = [await map_doc(d) for d in docs]
+        out = [_public_program(d, base) for d in docs]
         return {"value": out, "Count": len(out)}
 
     # Fallback: match documents in `programs` with activity type/tags
-    q = {
-        "$or": [
-            {"type": {"$regex": "activity|activities", "$options": "i"}},
-            {"tags": {"$elemMatch": {"$regex": "activity|activities", "$options": "i"}}}
-        ]
-    }
     try:
-        docs = await db["programs"].find(q).to_list(None)
+        docs = await db["programs"].find(_ACTIVITIES_Q, _PROGRAM_PROJECTION).to_list(None)
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to query programs for activities")
-    out = [await map_doc(d) for d in docs]
+    out = [_public_program(d, base) for d in docs]
     return {"value": out, "Count": len(out)}
 
 
+# Fields create_booking needs from rooms the guest picked explicitly.
+_ROOM_PRICE_PROJECTION = {"_id": 1, "price_per_night": 1, "pricePerNight": 1, "price": 1}
+# ...and from auto-allocation candidates: what allocate_rooms and pricing read.
+_ROOM_ALLOC_PROJECTION = dict(
+    _ROOM_PRICE_PROJECTION,
+    slug=1, type=1, capacity=1, sleeps=1, capacity_adults=1, capacity_children=1,
+    bedConfig=1, extra_beds=1, extra_bedding=1,
+)
+
+
+async def _find_programs(db, pids) -> dict:
+    """Resolve selected program ids to documents with one query per collection.
+
+    Precedence per id matches the old one-by-one lookups: wellnessPrograms by
+    ObjectId, then wellnessPrograms by string `id`/`_id`, then programs by
+    string `_id`/`id`.
+    """
+    sids = [str(pid) for pid in pids]
+    oids = [parse_oid(pid) for pid in sids if ObjectId.is_valid(pid)]
+    wp_docs, pg_docs = await asyncio.gather(
+        db["wellnessPrograms"].find({"$or": [{"_id": {"$in": oids + sids}}, {"id": {"$in": sids}}]}).to_list(None),
+        db["programs"].find({"$or": [{"_id": {"$in": sids}}, {"id": {"$in": sids}}]}).to_list(None),
+    )
+
+    def by_str(docs):
+        out = {}
+        for d in docs:
+            for key in (d.get("id"), d.get("_id")):
+                if isinstance(key, str):
+                    out.setdefault(key, d)
+        return out
+
+    wp_by_oid = {d["_id"]: d for d in wp_docs if isinstance(d.get("_id"), ObjectId)}
+    wp_by_str = by_str(wp_docs)
+    pg_by_str = by_str(pg_docs)
+    found = {}
+    for pid in sids:
+        doc = wp_by_oid.get(parse_oid(pid)) if ObjectId.is_valid(pid) else None
+        doc = doc or wp_by_str.get(pid) or pg_by_str.get(pid)
+        if doc:
+            found[pid] = doc
+    return found
+
+
 @router.post("/bookings", status_code=201)
 async def create_booking(request: Request, payload: BookingRequest = Body(...)):
     db = get_db_or_503(request)
@@ -791,33 +976,130 @@ async def create_booking(request: Request, payload: BookingRequest = Body(...)):
         raise HTTPException(status_code=400, detail="Invalid guest_email")
 
     selected = data.get("selected_cottages") or []
+    sel_programs = data.get("selected_programs") or []
 
-    busy_ids = await db["bookings"].distinct("allocated_cottages", {
+    # The conflict scan and program lookup don't depend on each other or on
+    # the room reads below, so start them now and await where consumed.
+    busy_task = asyncio.create_task(db["bookings"].distinct("allocated_cottages", {
         "status": {"$in": ["confirmed", "pending"]},
         "check_in": {"$lt": e},
         "check_out": {"$gt": s}
-    })
-    busy_ids = [b for b in busy_ids if b]
+    }))
+    prog_task = asyncio.create_task(_find_programs(db, sel_programs)) if sel_programs else None
+    try:
+        allocated = []
+        if selected:
+            for sid in selected:
+                try:
+                    allocated.append(parse_oid(sid))
+                except Exception:
+                    raise HTTPException(status_code=400, detail=f"Invalid cottage id {sid}")
+            # One existence query for all selected rooms (it also carries the
+            # prices used below); conflicts come from the shared busy set.
+            room_docs, busy_ids = await asyncio.gather(
+                db["rooms"].find({"_id": {"$in": allocated}}, _ROOM_PRICE_PROJECTION).to_list(length=None),
+                busy_task,
+            )
+            found = {d["_id"] for d in room_docs}
+            busy = set(b for b in busy_ids if b)
+            for sid, oid in zip(selected, allocated):
+                if oid not in found:
+                    raise HTTPException(status_code=400, detail=f"Cottage {sid} not found")
+                if oid in busy:
+                    raise HTTPException(status_code=400, detail=f"Cottage {sid} not available for selected dates")
+        else:
+            # Fetch all available rooms alongside the conflict scan and drop the
+            # busy ones here instead of waiting to build a $nin filter.
+            candidates, busy_ids = await asyncio.gather(
+                db["rooms"].find({"available": True}, _ROOM_ALLOC_PROJECTION).to_list(length=None),
+                busy_task,
+            )
+            busy = set(b for b in busy_ids if b)
+            candidates = [r for r in candidates if r["_id"] not in busy]
+            allow_extra = bool(data.get("allow_extra_beds", False) or data.get("extra_bedding", False))
+            prefs = data.get("preferred_room_types", None)
+            allocated = allocate_rooms(candidates, guests, allow_extra_beds=allow_extra, preferred_room_types=prefs, max_k=4)
+            if not allocated:
+                raise HTTPException(status_code=400, detail="Not enough cottages available for requested guests/dates")
+            room_docs = candidates
+        prog_docs = await prog_task if prog_task is not None else {}
+    finally:
+        for task in (busy_task, prog_task):
+            if task is not None and not task.done():
+                task.cancel()
 
-    allocated = []
-    if selected:
-        for sid in selected:
-            try:
-                oid = ObjectId(sid)
-            except Exception:
-                raise HTTPException(status_code=400, detail=f"Invalid cottage id {sid}")
-            room = await db["rooms"].find_one({"_id": oid})
-            if not room:
-                raise HTTPException(status_code=400, detail=f"Cottage {sid} not found")
-            overlapping = await db["bookings"].find_one({
-                "allocated_cottages": oid,
-                "status": {"$in": ["confirmed", "pending"]},
-                "check_in": {"$lt": e},
-                "check_out": {"$gt": s}
-            })
-            if overlapping:
-                raise HTTPException(status_code=400, detail=f"Cottage {sid} not available for selected dates")
-            allocated.append(oid)
+    doc = {
+        "reference": None,
+        "guest_name": data.get("guest_name"),
+        "guest_email": email,
+        "guest_email_lc": email.lower(),
+        "guest_phone": data.get("guest_phone"),
+        "guests": guests,
+        "selected_cottages": selected,
+        "allocated_cottages": allocated,
+        "extra_bedding": bool(data.get("allow_extra_beds", False) or data.get("extra_bedding", False)),
+        "check_in": s,
+        "check_out": e,
+        "nights": (e - s).days,
+        "price_breakdown": {},
+        "status": "pending",
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+    }
+
+    nights = doc.get("nights", 0) or 0
+    # Price from the room documents already fetched above.
+    rooms_by_id = {r["_id"]: r for r in room_docs}
+    rooms_subtotal = 0.0
+    per_room = []
+    for rid in dict.fromkeys(allocated):
+        r = rooms_by_id[rid]
+        price = r.get("price_per_night") or r.get("pricePerNight") or r.get("price") or 0
+        rooms_subtotal += float(price) * max(int(nights), 1)
+        per_room.append({"room_id": str(r.get("_id")), "price_per_night": price})
+
+    # Handle selected wellness programs (optional) and include in pricing
+    programs_subtotal = 0.0
+    program_items = []
+    for pid in sel_programs:
+        prog_doc = prog_docs.get(pid)
+        if not prog_doc:
+            # not found; skip silently to avoid blocking booking creation
+            continue
+        p = serialize_doc(prog_doc)
+        p_price = p.get("price") or p.get("price_inr") or p.get("cost") or 0
+        try:
+            p_price_val = int(float(p_price))
+        except Exception:
+            p_price_val = 0
+        programs_subtotal += p_price_val
+        program_items.append({"program_id": str(p.get("id") or p.get("_id") or pid), "title": p.get("title") or p.get("name"), "price": p_price_val})
+
+    combined_subtotal = rooms_subtotal + programs_subtotal
+    tax = round(combined_subtotal * 0.18, 2)
+    total = round(combined_subtotal + tax, 2)
+    doc["price_breakdown"] = {
+        "rooms_subtotal": round(rooms_subtotal, 2),
+        "programs_subtotal": round(programs_subtotal, 2),
+        "tax": tax,
+        "total": total,
+        "per_room": per_room,
+        "programs": program_items,
+    }
+
+    # Drawn last: the reference bumps the counter, so requests rejected above
+    # (or failing in pricing) must not use one up.
+    doc["reference"] = await gen_reference(db)
+    res = await db["bookings"].insert_one(doc)
+    created = await db["bookings"].find_one({"_id": res.inserted_id})
+
+    out = serialize_doc(created)
+    try:
+        publish_event({"event": "bookings.created", "payload": {"id": out.get("id"), "reference": out.get("reference"), "status": out.get("status")}})
+    except Exception:
+        pass
+
+    return {"id": out.get("id"), "reference": out.get("reference"), "status": out.get("status"), "allocated_cottages": out.get("allocated_cottages"), "price_breakdown": out.get("price_breakdown")}
 
 
 @router.get("/_debug/room/{room_id}")
@@ -849,6 +1131,12 @@ async def debug_room(request: Request, room_id: str):
     return {"found": False, "tried": tried, "matches": [serialize_doc(d) for d in docs]}
 
 
+@functools.lru_cache(maxsize=2048)
+def _name_regex(name: str) -> dict:
+    # Shared between calls: treat the returned filter as read-only.
+    return {"$regex": f"^{re.escape(name)}$", "$options": "i"}
+
+
 @router.get("/rooms/name-debug/{room_name}")
 async def rooms_name_debug(request: Request, room_name: str):
     """Debug helper: return room document using several lookup strategies (name/slug/id/_id/accommodation)."""
@@ -869,14 +1157,14 @@ async def rooms_name_debug(request: Request, room_name: str):
         pass
     # try name regex
     try:
-        doc = await db["rooms"].find_one({"name": {"$regex": f"^{re.escape(room_name)}$", "$options": "i"}})
+        doc = await db["rooms"].find_one({"name": _name_regex(room_name)})
         if doc:
             return {"found": True, "method": "name", "doc": serialize_doc(doc)}
     except Exception:
         pass
     # try accommodation lookup
     try:
-        acc = await db["accommodations"].find_one({"$or": [{"slug": room_name}, {"id": room_name}, {"name": {"$regex": f"^{re.escape(room_name)}$", "$options": "i"}}]})
+        acc = await db["accommodations"].find_one({"$or": [{"slug": room_name}, {"id": room_name}, {"name": _name_regex(room_name)}]})
     except Exception:
         acc = None
     if acc:
@@ -888,111 +1176,30 @@ async def rooms_name_debug(request: Request, room_name: str):
     return {"found": False}
 
 
+_DEBUG_COUNTS_TTL = 30.0
+_COUNTS_CACHE = TTLCache(ttl=_DEBUG_COUNTS_TTL)
+
+
+async def _load_counts(db) -> dict:
+    acc, rooms, bookings = await asyncio.gather(
+        db["accommodations"].count_documents({}),
+        db["rooms"].count_documents({}),
+        db["bookings"].count_documents({}),
+    )
+    return {"accommodations": acc, "rooms": rooms, "bookings": bookings}
+
+
 @router.get("/_debug/counts")
 async def debug_counts(request: Request):
     db = get_db_or_503(request)
     try:
-        acc = await db["accommodations"].count_documents({})
-        rooms = await db["rooms"].count_documents({})
-        bookings = await db["bookings"].count_documents({})
-        names = await db.list_collection_names()
-        return {"ok": True, "counts": {"accommodations": acc, "rooms": rooms, "bookings": bookings}, "collections": names}
+        # Debug view only: counts may be up to _DEBUG_COUNTS_TTL seconds stale.
+        counts = await _COUNTS_CACHE.get_or_load(id(db), lambda: _load_counts(db))
+        names = sorted(await _collection_names(db))
+        return {"ok": True, "counts": counts, "collections": names}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    if not allocated:
-        q = {"available": True}
-        if busy_ids:
-            q["_id"] = {"$nin": busy_ids}
-        candidates = await db["rooms"].find(q).to_list(length=None)
-        allow_extra = bool(data.get("allow_extra_beds", False) or data.get("extra_bedding", False))
-        prefs = data.get("preferred_room_types", None)
-        allocated = allocate_rooms(candidates, guests, allow_extra_beds=allow_extra, preferred_room_types=prefs, max_k=4)
-        if not allocated:
-            raise HTTPException(status_code=400, detail="Not enough cottages available for requested guests/dates")
-
-    doc = {
-        "reference": gen_reference(),
-        "guest_name": data.get("guest_name"),
-        "guest_email": email,
-        "guest_phone": data.get("guest_phone"),
-        "guests": guests,
-        "selected_cottages": selected,
-        "allocated_cottages": allocated,
-        "extra_bedding": bool(data.get("allow_extra_beds", False) or data.get("extra_bedding", False)),
-        "check_in": s,
-        "check_out": e,
-        "nights": (e - s).days,
-        "price_breakdown": {},
-        "status": "pending",
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow(),
-    }
-
-    nights = doc.get("nights", 0) or 0
-    room_docs = []
-    if allocated:
-        room_docs = await db["rooms"].find({"_id": {"$in": allocated}}).to_list(length=None)
-    rooms_subtotal = 0.0
-    per_room = []
-    for r in room_docs:
-        price = r.get("price_per_night") or r.get("pricePerNight") or r.get("price") or 0
-        rooms_subtotal += float(price) * max(int(nights), 1)
-        per_room.append({"room_id": str(r.get("_id")), "price_per_night": price})
-
-    # Handle selected wellness programs (optional) and include in pricing
-    programs_subtotal = 0.0
-    program_items = []
-    sel_programs = data.get("selected_programs") or []
-    if sel_programs:
-        for pid in sel_programs:
-            prog_doc = None
-            try:
-                oid = ObjectId(pid)
-                prog_doc = await db["wellnessPrograms"].find_one({"_id": oid})
-            except Exception:
-                prog_doc = None
-            if not prog_doc:
-                # try string match fields in wellnessPrograms
-                prog_doc = await db["wellnessPrograms"].find_one({"$or": [{"id": pid}, {"_id": pid}]})
-            if not prog_doc:
-                prog_doc = await db["programs"].find_one({"$or": [{"_id": pid}, {"id": pid}]})
-            if not prog_doc:
-                # not found; skip silently to avoid blocking booking creation
-                continue
-            p = serialize_doc(prog_doc)
-            p_price = p.get("price") or p.get("price_inr") or p.get("cost") or 0
-            try:
-                p_price_val = int(float(p_price))
-            except Exception:
-                p_price_val = 0
-            programs_subtotal += p_price_val
-            program_items.append({"program_id": str(p.get("id") or p.get("_id") or pid), "title": p.get("title") or p.get("name"), "price": p_price_val})
-
-    combined_subtotal = rooms_subtotal + programs_subtotal
-    tax = round(combined_subtotal * 0.18, 2)
-    total = round(combined_subtotal + tax, 2)
-    doc["price_breakdown"] = {
-        "rooms_subtotal": round(rooms_subtotal, 2),
-        "programs_subtotal": round(programs_subtotal, 2),
-        "tax": tax,
-        "total": total,
-        "per_room": per_room,
-        "programs": program_items,
-    }
-
-    res = await db["bookings"].insert_one(doc)
-    created = await db["bookings"].find_one({"_id": res.inserted_id})
-
-    out = serialize_doc(created)
-    try:
-        from routes.events import publish_event
-        publish_event({"event": "bookings.created", "payload": {"id": out.get("id"), "reference": out.get("reference"), "status": out.get("status")}})
-    except Exception:
-        pass
-
-    return {"id": out.get("id"), "reference": out.get("reference"), "status": out.get("status"), "allocated_cottages": out.get("allocated_cottages"), "price_breakdown": out.get("price_breakdown")}
-
 
 @router.get("/debug/db-info")
 async def debug_db_info(request: Request, sample_col: Optional[str] = None, limit: int = 5):
@@ -1002,7 +1209,7 @@ async def debug_db_info(request: Request, sample_col: Optional[str] = None, limi
     """
     db = get_db_or_503(request)
     try:
-        names = await db.list_collection_names()
+        names = sorted(await _collection_names(db))
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to list collections")
     out = {"collections": names}
@@ -1,19 +1,25 @@
 from fastapi import APIRouter, Request
-from utils import get_db_or_503, serialize_doc
+from utils import get_db_or_503, serialize_doc, TTLCache
 
 router = APIRouter(prefix="/api", tags=["api-site"])
 
+# The site document changes rarely; serve it from memory for a minute at a time.
+_SITE_CACHE = TTLCache(ttl=60.0)
+
 
 @router.get("/site")
 async def get_site_config(request: Request):
     db = get_db_or_503(request)
-    # Try to read a single site config document from `site` collection
+
+    async def load():
+        # Try to read a single site config document from `site` collection
+        return serialize_doc(await db["site"].find_one({}))
+
     try:
-        doc = await db["site"].find_one({})
+        doc = await _SITE_CACHE.get_or_load(id(db), load)
     except Exception:
         doc = None
     if not doc:
         # Fallback minimal config
         return {"siteName": "Resort", "apiBase": "/api"}
-    return serialize_doc(doc)
-"""Removed: this file was added by assistant earlier and is no longer used."""
+    return doc
@@ -1,25 +1,85 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request, Query
 from models import Booking
 from bson import ObjectId
 from datetime import datetime, timedelta
 import pymongo
+from pymongo import WriteConcern
 import asyncio
 from uuid import uuid4
 from fastapi import Depends
 from routes.gallery import admin_key_dep
 from lib.locks import acquire_lock, release_lock
-from utils import get_db_or_503, serialize_doc
+from utils import get_db_or_503, serialize_doc, docs_response, parse_oid
 from routes.events import publish_event
+from routes.auth import get_current_user
 
 router = APIRouter(prefix="/bookings", tags=["bookings"])
 
 
+# Fire-and-forget writes for admin cleanup that doesn't need a count back
+_UNACKNOWLEDGED = WriteConcern(w=0)
+
+# List views leave out the per-room pricing detail; fetch a single booking for it.
+_LIST_PROJECTION = {"price_breakdown.per_room": 0}
+# Newest first, with a stable order so skip/limit pages don't overlap
+_NEWEST_FIRST = [("_id", -1)]
+MAX_PAGE_SIZE = 500
+
+
+def _is_duplicate_key(exc: Exception) -> bool:
+    """insert_one raises DuplicateKeyError; insert_many wraps it in BulkWriteError."""
+    if isinstance(exc, pymongo.errors.DuplicateKeyError):
+        return True
+    if isinstance(exc, pymongo.errors.BulkWriteError):
+        return any(err.get("code") == 11000 for err in exc.details.get("writeErrors", []))
+    return False
+
+
+def _as_int(expr):
+    return {"$convert": {"input": expr, "to": "int", "onError": 0, "onNull": 0}}
+
+
+def _or(a, b):
+    """Python's ``a or b``: falls through on missing, null, 0, "" and false
+    (``$ifNull`` only falls through on missing/null)."""
+    return {"$cond": [{"$in": [{"$ifNull": [a, None]}, [None, 0, "", False]]}, b, a]}
+
+
+def _capacity_pipeline(acc_key):
+    """Accommodation capacity plus the summed capacity/extra beds of its rooms.
+
+    Rooms may reference the accommodation by ObjectId or by its string form.
+    """
+    return [
+        {"$match": {"_id": acc_key}},
+        {"$limit": 1},
+        {"$lookup": {
+            "from": "rooms",
+            "let": {"aid": "$_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$in": ["$accommodation_id", ["$$aid", {"$toString": "$$aid"}]]}}},
+                {"$project": {
+                    "cap": _as_int(_or("$capacity", "$sleeps")),
+                    "extra": _as_int(_or("$extra_beds", "$extra_bedding")),
+                }},
+            ],
+            "as": "rooms",
+        }},
+        {"$project": {
+            "own_cap": _as_int(_or("$capacity", "$sleeps")),
+            "cap": {"$sum": "$rooms.cap"},
+            "extra": {"$sum": "$rooms.extra"},
+            "room_count": {"$size": "$rooms"},
+        }},
+    ]
+
+
 @router.get("/")
-async def get_all_bookings(request: Request):
+async def get_all_bookings(request: Request, limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), skip: int = Query(0, ge=0)):
     """Get all bookings"""
     db = get_db_or_503(request)
-    bookings = await db["bookings"].find().to_list(None)
-    return [serialize_doc(b) for b in bookings]
+    bookings = await db["bookings"].find({}, _LIST_PROJECTION).sort(_NEWEST_FIRST).skip(skip).limit(limit).to_list(None)
+    return docs_response(bookings)
 
 
 @router.get("/{booking_id}")
@@ -27,7 +87,7 @@ async def get_booking(request: Request, booking_id: str):
     """Get a specific booking by ID"""
     db = get_db_or_503(request)
     try:
-        booking = await db["bookings"].find_one({"_id": ObjectId(booking_id)})
+        booking = await db["bookings"].find_one({"_id": parse_oid(booking_id)})
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid booking id")
     if not booking:
@@ -41,19 +101,15 @@ async def create_booking(request: Request, booking: Booking):
     db = get_db_or_503(request)
     booking_dict = booking.dict()
     booking_dict["created_at"] = datetime.utcnow()
+    # Lowercased copy for the indexed guest lookups
+    booking_dict["guest_email_lc"] = (booking_dict.get("guest_email") or "").lower()
     # If request contains Authorization Bearer token, attach user id to booking
     try:
-        from routes.auth import get_current_user
-        user = None
-        try:
-            user = get_current_user(request)
-        except Exception:
-            user = None
-        if user and user.get('id'):
-            booking_dict['user_id'] = user.get('id')
+        user = get_current_user(request)
     except Exception:
-        # ignore if auth helper not available
-        pass
+        user = None
+    if user and user.get('id'):
+        booking_dict['user_id'] = user.get('id')
     # Basic validation
     if booking_dict["check_in"] >= booking_dict["check_out"]:
         raise HTTPException(status_code=400, detail="check_in must be before check_out")
@@ -70,35 +126,30 @@ async def create_booking(request: Request, booking: Booking):
         guests_req = None
     if guests_req is not None:
         try:
-            # try rooms collection first
-            room = await db["rooms"].find_one({"_id": booking_dict.get("accommodation_id")})
-            acc = None
-            if not room:
-                # try as ObjectId-like string or as accommodation doc
-                try:
-                    from bson import ObjectId as _OID
-                    acc = await db["accommodations"].find_one({"_id": _OID(booking_dict.get("accommodation_id"))})
-                except Exception:
-                    acc = await db["accommodations"].find_one({"_id": booking_dict.get("accommodation_id")})
+            acc_id = booking_dict.get("accommodation_id")
+            acc_key = parse_oid(acc_id) if ObjectId.is_valid(acc_id) else acc_id
+            async def _capacity():
+                return await (await db["accommodations"].aggregate(_capacity_pipeline(acc_key))).to_list(1)
+
+            # The room lookup and the accommodation + summed-rooms aggregation run
+            # concurrently instead of as up to four sequential queries.
+            room, accs = await asyncio.gather(db["rooms"].find_one({"_id": acc_id}), _capacity())
+            acc = accs[0] if accs else None
 
             # compute capacity
             total_cap = 0
+            extra_available = 0
             if room:
                 total_cap = int(room.get("capacity") or room.get("sleeps") or 0)
                 eb = room.get("extra_beds") if room.get("extra_beds") is not None else room.get("extra_bedding")
                 extra_available = int(eb) if eb is not None else 0
             elif acc:
-                total_cap = int(acc.get("capacity") or acc.get("sleeps") or 0)
-                # if accommodation has rooms, sum their capacity
-                try:
-                    rooms = await db["rooms"].find({"$or": [{"accommodation_id": acc.get("_id")}, {"accommodation_id": str(acc.get("_id"))}]}).to_list(None)
-                    if rooms:
-                        total_cap = sum(int(r.get("capacity") or r.get("sleeps") or 0) for r in rooms)
-                        extra_available = sum(int(r.get("extra_beds") or r.get("extra_bedding") or 0) for r in rooms)
-                except Exception:
-                    extra_available = 0
-            else:
-                extra_available = 0
+                # if accommodation has rooms, their summed capacity wins
+                if acc.get("room_count"):
+                    total_cap = int(acc.get("cap") or 0)
+                    extra_available = int(acc.get("extra") or 0)
+                else:
+                    total_cap = int(acc.get("own_cap") or 0)
 
             if booking_dict.get("allow_extra_beds"):
                 requested_extra = int(booking_dict.get("extra_beds_qty") or 0)
@@ -115,12 +166,9 @@ async def create_booking(request: Request, booking: Booking):
     # Build list of nights (dates) the booking will occupy (check_in date .. check_out date - 1)
     start_date = booking_dict["check_in"].date()
     end_date = booking_dict["check_out"].date()
-    nights = []
-    d = start_date
-    while d < end_date:
-        # store as midnight UTC datetime for a single-night occupancy document
-        nights.append(datetime(d.year, d.month, d.day))
-        d += timedelta(days=1)
+    # stored as midnight UTC datetimes, one occupancy document per night
+    midnight = datetime.min.time()
+    nights = [datetime.combine(start_date + timedelta(days=i), midnight) for i in range((end_date - start_date).days)]
 
     client = getattr(request.app.state, "db_client", None)
 
@@ -128,10 +176,10 @@ async def create_booking(request: Request, booking: Booking):
     lock_key = f"accom:{booking_dict['accommodation_id']}:{start_date.isoformat()}:{end_date.isoformat()}"
 
     # If we have a MongoDB client that supports transactions (replica set), prefer a transaction
-    if client is not None and hasattr(client, "start_session"):
+    if client is not None and getattr(request.app.state, "supports_txn", False):
         try:
             async with client.start_session() as session:
-                async with session.start_transaction():
+                async with await session.start_transaction():
                     result = await db["bookings"].insert_one(booking_dict, session=session)
                     booking_id = result.inserted_id
                     # create per-night occupancy documents to enforce uniqueness
@@ -164,33 +212,44 @@ async def create_booking(request: Request, booking: Booking):
         if not lock_owner:
             raise HTTPException(status_code=409, detail="Accommodation is busy; try again")
         try:
+            # Overlap check while holding the lock. The unique (accommodation_id,
+            # date) index on occupancies is a second line of defence, but it is
+            # built in the background at startup and doesn't cover stays that
+            # start and end on the same day (no nights).
             overlap = await db["bookings"].find_one({
                 "accommodation_id": booking_dict["accommodation_id"],
                 "status": {"$ne": "cancelled"},
                 "check_in": {"$lt": booking_dict["check_out"]},
                 "check_out": {"$gt": booking_dict["check_in"]},
-            })
+            }, {"_id": 1})
             if overlap:
                 raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
-            # insert booking and create occupancy docs (best-effort)
-            result = await db["bookings"].insert_one(booking_dict)
-            booking_id = result.inserted_id
-            occ_docs = []
-            for nd in nights:
-                occ_docs.append({
-                    "accommodation_id": booking_dict["accommodation_id"],
-                    "date": nd,
-                    "booking_id": booking_id,
-                    "created_at": datetime.utcnow(),
-                })
+            # The _id is assigned here so the booking and its occupancies are
+            # written concurrently.
+            booking_id = ObjectId()
+            booking_dict["_id"] = booking_id
+            now = datetime.utcnow()
+            occ_docs = [{
+                "accommodation_id": booking_dict["accommodation_id"],
+                "date": nd,
+                "booking_id": booking_id,
+                "created_at": now,
+            } for nd in nights]
+            writes = [db["bookings"].insert_one(booking_dict)]
             if occ_docs:
-                try:
-                    await db["occupancies"].insert_many(occ_docs, ordered=True)
-                except pymongo.errors.DuplicateKeyError:
-                    # Another concurrent write booked one of the nights in the gap between our check and insert
-                    # Roll back booking and return conflict
-                    await db["bookings"].delete_one({"_id": booking_id})
+                writes.append(db["occupancies"].insert_many(occ_docs, ordered=True))
+            errors = [r for r in await asyncio.gather(*writes, return_exceptions=True) if isinstance(r, Exception)]
+            if errors:
+                # Undo whichever writes landed (an ordered insert_many may have
+                # stored the nights before the clash).
+                await asyncio.gather(
+                    db["bookings"].delete_one({"_id": booking_id}),
+                    db["occupancies"].delete_many({"booking_id": booking_id}),
+                )
+                if any(_is_duplicate_key(exc) for exc in errors):
+                    # One of the nights is already occupied
                     raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
+                raise errors[0]
             created = await db["bookings"].find_one({"_id": booking_id})
         finally:
             try:
@@ -210,16 +269,19 @@ async def create_booking(request: Request, booking: Booking):
 async def update_booking(request: Request, booking_id: str, booking: Booking):
     """Update a booking"""
     db = get_db_or_503(request)
+    payload = booking.dict()
+    # keep the indexed guest lookup key in step with an edited email
+    payload["guest_email_lc"] = (payload.get("guest_email") or "").lower()
     try:
         result = await db["bookings"].update_one(
-            {"_id": ObjectId(booking_id)},
-            {"$set": booking.dict()}
+            {"_id": parse_oid(booking_id)},
+            {"$set": payload}
         )
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid booking id")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Booking not found")
-    updated = await db["bookings"].find_one({"_id": ObjectId(booking_id)})
+    updated = await db["bookings"].find_one({"_id": parse_oid(booking_id)})
     return serialize_doc(updated)
 
 
@@ -228,7 +290,7 @@ async def delete_booking(request: Request, booking_id: str):
     """Delete a booking"""
     db = get_db_or_503(request)
     try:
-        b_id = ObjectId(booking_id)
+        b_id = parse_oid(booking_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid booking id")
     booking = await db["bookings"].find_one({"_id": b_id})
@@ -247,33 +309,38 @@ async def delete_booking(request: Request, booking_id: str):
 
 
 @router.get("/guest/{guest_email}")
-async def get_guest_bookings(request: Request, guest_email: str):
+async def get_guest_bookings(request: Request, guest_email: str, limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), skip: int = Query(0, ge=0)):
     """Get all bookings for a specific guest"""
     db = get_db_or_503(request)
-    bookings = await db["bookings"].find({"guest_email": guest_email}).to_list(None)
-    return [serialize_doc(b) for b in bookings]
+    bookings = await db["bookings"].find({"guest_email_lc": guest_email.lower()}, _LIST_PROJECTION).sort(_NEWEST_FIRST).skip(skip).limit(limit).to_list(None)
+    return docs_response(bookings)
 
 
 @router.get('/me')
-async def my_bookings(request: Request):
+async def my_bookings(request: Request, limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), skip: int = Query(0, ge=0)):
     """Return bookings for the currently authenticated user (requires Authorization: Bearer <token>)"""
     # lightweight token auth reuse from auth.get_current_user
-    from routes.auth import get_current_user
     user = get_current_user(request)
     db = get_db_or_503(request)
     # match by user id or user email
-    q = {"$or": [{"user_id": user.get('id')}, {"guest_email": user.get('email')}]} if user else {}
-    bookings = await db['bookings'].find(q).to_list(None)
-    return [serialize_doc(b) for b in bookings]
+    q = {"$or": [{"user_id": user.get('id')}, {"guest_email_lc": (user.get('email') or "").lower()}]} if user else {}
+    bookings = await db['bookings'].find(q, _LIST_PROJECTION).sort(_NEWEST_FIRST).skip(skip).limit(limit).to_list(None)
+    return docs_response(bookings)
 
 
 @router.post("/{booking_id}/release", dependencies=[Depends(admin_key_dep)])
-async def release_occupancies_endpoint(request: Request, booking_id: str):
-    """Admin-safe endpoint: release occupancies associated with a booking id."""
+async def release_occupancies_endpoint(request: Request, booking_id: str, fast: bool = False):
+    """Admin-safe endpoint: release occupancies associated with a booking id.
+
+    With ``fast=1`` the delete is sent unacknowledged (w=0) and ``released`` is -1.
+    """
     db = get_db_or_503(request)
     try:
-        b_id = ObjectId(booking_id)
+        b_id = parse_oid(booking_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid booking id")
+    if fast:
+        await db["occupancies"].with_options(write_concern=_UNACKNOWLEDGED).delete_many({"booking_id": b_id})
+        return {"released": -1}
     res = await db["occupancies"].delete_many({"booking_id": b_id})
     return {"released": int(res.deleted_count)}
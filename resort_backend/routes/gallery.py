@@ -1,101 +1,250 @@
-from fastapi import APIRouter, Request, HTTPException, UploadFile, File, Form, Depends
-from fastapi.responses import JSONResponse
-from typing import Optional
+from fastapi import APIRouter, Request, HTTPException, UploadFile, File, Form, Depends, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
+from typing import Optional, BinaryIO, List
+from contextlib import asynccontextmanager
+from pydantic import BaseModel
+import asyncio
 import os
+import re
+import hashlib
+import hmac
+import shutil
+import time
+import orjson
 from bson import ObjectId
-from datetime import datetime
-from utils import get_db_or_503, serialize_doc
+from pymongo import ReturnDocument
+from datetime import datetime, timezone
+from utils import get_db_or_503, serialize_doc, doc_response, oid_or_400, base_url_prefix, encode_after, after_filter, TTLCache, WORKER_COUNT
 
-router = APIRouter(prefix="/gallery", tags=["gallery"])
+router = APIRouter(prefix="/gallery", tags=["gallery"], default_response_class=ORJSONResponse)
 
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "..", "uploads", "gallery")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Partial files for resumable uploads; kept outside the publicly served uploads dir.
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or os.path.join(os.path.dirname(__file__), "..", "upload_tmp")
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+# Uploads are copied to disk in slices of this size so memory stays bounded.
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1 << 20)))
+
+# Largest file a resumable upload may declare; its part file is preallocated.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 << 20)))
+
+
+def _copy_stream(src: BinaryIO, dest: str) -> str:
+    """Copy `src` to `dest` chunk by chunk; returns the content's blake2b digest."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(dest, "wb") as f:
+        while True:
+            chunk = src.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+# Admission control for disk writes: at most UPLOAD_CONCURRENCY uploads copy
+# at once; beyond UPLOAD_QUEUE_MAX waiters new ones get a 503 + Retry-After.
+_UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "8"))
+_UPLOAD_QUEUE_MAX = int(os.getenv("UPLOAD_QUEUE_MAX", "32"))
+_upload_sem = asyncio.Semaphore(_UPLOAD_CONCURRENCY)
+_upload_waiting = 0
+
+
+@asynccontextmanager
+async def _upload_slot():
+    global _upload_waiting
+    if _upload_sem.locked() and _upload_waiting >= _UPLOAD_QUEUE_MAX:
+        raise HTTPException(status_code=503, detail="Too many uploads in progress; retry shortly", headers={"Retry-After": "5"})
+    _upload_waiting += 1
+    try:
+        await _upload_sem.acquire()
+    finally:
+        _upload_waiting -= 1
+    try:
+        yield
+    finally:
+        _upload_sem.release()
+
+
+_NEWEST_FIRST = [("createdAt", -1), ("_id", -1)]
+MAX_PAGE_SIZE = 500
+
+# Rendered list pages: {(base, category, visible, limit, skip, after): (etag, body)}.
+# Cleared on every gallery write. Only cached pages carry an ETag: the first,
+# streamed response for a key has its headers sent before the body exists.
+_LIST_CACHE = TTLCache(ttl=10.0, maxsize=128)
+_LIST_CACHE_HEADERS = {"Cache-Control": "public, max-age=30"}
+
+# Encoded single items by lowercased id; dropped on update/delete. Only the
+# worker that handled the write drops its copy, so with several workers
+# (WEB_CONCURRENCY > 1) the cache is off rather than up to 60s stale.
+_ITEM_CACHE = TTLCache(ttl=60.0, maxsize=1024 if WORKER_COUNT == 1 else 0)
+
+# Only the fields the public list shape reads; `media` is trimmed to the first
+# entry server-side since only media[0] is used as an image fallback.
+_LIST_PROJECTION = {
+    "caption": 1, "title": 1, "description": 1, "imageUrl": 1, "image": 1,
+    "media": {"$slice": 1}, "category": 1, "categoryName": 1, "isVisible": 1, "createdAt": 1,
+}
+
+
+ADMIN_KEY = os.environ.get("ADMIN_API_KEY")
+_ADMIN_KEY_BYTES = ADMIN_KEY.encode() if ADMIN_KEY is not None else None
+
 
 def admin_key_dep(request: Request):
-    """Simple admin key dependency (optional). Reads X-Admin-Key header and compares to env var ADMIN_API_KEY."""
-    from os import getenv
-    key = request.headers.get("X-Admin-Key")
-    expected = getenv("ADMIN_API_KEY")
-    if expected is None:
+    """Simple admin key dependency (optional). Compares the X-Admin-Key header to ADMIN_API_KEY (read at startup)."""
+    if _ADMIN_KEY_BYTES is None:
         # no admin key configured — allow in dev
         return True
-    if key != expected:
+    key = request.headers.get("X-Admin-Key") or ""
+    # constant-time compare so response timing doesn't leak the key
+    if not hmac.compare_digest(key.encode(), _ADMIN_KEY_BYTES):
         raise HTTPException(status_code=403, detail="Forbidden")
     return True
 
 
-@router.get("/", response_class=JSONResponse)
-async def list_gallery(request: Request, category: Optional[str] = None, visible: Optional[bool] = None, limit: int = 50, skip: int = 0):
+@router.get("/")
+async def list_gallery(request: Request, category: Optional[str] = None, visible: Optional[bool] = None, limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE), skip: int = Query(0, ge=0), after: Optional[str] = None):
     db = get_db_or_503(request)
+    base = base_url_prefix(request)
+    cache_key = (base, category, visible, limit, skip, after)
+    generation = _LIST_CACHE.generation
+    hit = _LIST_CACHE.get(cache_key)
+    if hit is not None:
+        etag, body = hit
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag, **_LIST_CACHE_HEADERS})
+        return Response(body, media_type="application/json", headers={"ETag": etag, **_LIST_CACHE_HEADERS})
+
     query = {}
     if category:
         query["category"] = category
-    # Treat missing `isVisible` as visible in legacy data: when visible=True,
-    # include documents that either have isVisible=True or have no isVisible field.
+    # Docs without `isVisible` count as visible. The startup backfill only
+    # covers docs that existed then (seed scripts and direct inserts may omit
+    # it), so match null/missing too; $in still uses the isVisible indexes.
     if visible is not None:
-        if visible:
-            query["$or"] = [{"isVisible": True}, {"isVisible": {"$exists": False}}]
-        else:
-            # explicit false: only return documents with isVisible set to False
-            query["isVisible"] = False
+        query["isVisible"] = {"$in": [True, None]} if visible else False
 
+    if after:
+        query.update(after_filter(after, "createdAt"))
+    # Cursor mode: seek past the last item seen instead of skipping, so deep
+    # pages cost the same as the first. An empty token starts at the top.
+    cursor_mode = after is not None
+    cursor = db.gallery.find(query, _LIST_PROJECTION).sort(_NEWEST_FIRST)
+    if cursor_mode:
+        cursor = cursor.limit(limit + 1)
+    else:
+        cursor = cursor.skip(skip).limit(limit)
     try:
-        cursor = db.gallery.find(query).skip(skip).limit(limit)
-        items = await cursor.to_list(length=limit)
+        # Read the first batch before the response starts so a failing query is
+        # still a 500 rather than a truncated body.
+        first = await anext(cursor, None)
     except Exception:
+        await cursor.close()
         raise HTTPException(status_code=500, detail="Failed to query gallery collection")
 
-    serialized = [serialize_doc(d) for d in items]
-    # Map to public shape expected by frontend
-    out = []
-    for doc in serialized:
-        caption = doc.get("caption") or doc.get("title") or doc.get("description") or ""
-        description = doc.get("description") or ""
-        imageUrl = doc.get("imageUrl") or doc.get("image") or (doc.get("media") and doc.get("media")[0] if isinstance(doc.get("media"), list) and len(doc.get("media"))>0 else None)
-        category_val = doc.get("category") or doc.get("categoryName") or ""
-        # If imageUrl is a relative path (e.g. /uploads/...), prefix with request.base_url so
-        # browser loads the image from the backend origin rather than the frontend origin.
-        if imageUrl and isinstance(imageUrl, str) and imageUrl.startswith('/'):
-            imageUrl = str(request.base_url).rstrip('/') + imageUrl
-
-        out.append({
-            "id": doc.get("id"),
-            "caption": caption,
-            "description": description,
-            "imageUrl": imageUrl,
-            "category": category_val,
-            "isVisible": doc.get("isVisible", True),
-            "createdAt": doc.get("createdAt"),
-        })
-
-    return out
+    async def gen():
+        # Items are encoded as the cursor yields them, so the client starts
+        # receiving the page while later batches are still being read.
+        parts = []
+        try:
+            parts.append(b'{"items":[' if cursor_mode else b"[")
+            yield parts[-1]
+            doc, last, n = first, None, 0
+            while doc is not None:
+                if cursor_mode and n == limit:
+                    break  # the look-ahead item: there is a next page
+                parts.append((b"," if n else b"") + orjson.dumps(_public_item(doc, base), default=str))
+                yield parts[-1]
+                last, n = doc, n + 1
+                doc = await anext(cursor, None)
+            if cursor_mode:
+                next_cursor = encode_after(last, "createdAt") if doc is not None and last is not None else None
+                parts.append(b'],"nextCursor":' + orjson.dumps(next_cursor) + b"}")
+            else:
+                parts.append(b"]")
+            yield parts[-1]
+        finally:
+            await cursor.close()
+        # Only a fully sent page is cached; later identical requests get it
+        # with an ETag (and a 304 when the client already has it). A write
+        # while this page was streaming cleared the cache; don't undo that.
+        if _LIST_CACHE.generation != generation:
+            return
+        body = b"".join(parts)
+        _LIST_CACHE.set(cache_key, ('"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"', body))
+
+    return StreamingResponse(gen(), media_type="application/json", headers=_LIST_CACHE_HEADERS)
+
+
+def _public_item(doc: dict, base: str) -> dict:
+    """Map a raw gallery doc to the public shape expected by the frontend.
+
+    Values are left as BSON types; orjson renders datetimes itself.
+    """
+    _get = doc.get
+    description = _get("description")
+    img = _get("imageUrl") or _get("image")
+    if not img:
+        media = _get("media")
+        img = media[0] if isinstance(media, list) and media else None
+    # If imageUrl is a relative path (e.g. /uploads/...), prefix with request.base_url so
+    # browser loads the image from the backend origin rather than the frontend origin.
+    if img and isinstance(img, str) and img[0] == "/":
+        img = base + img
+    return {
+        "id": str(doc["_id"]),
+        "caption": _get("caption") or _get("title") or description or "",
+        "description": description or "",
+        "imageUrl": img,
+        "category": _get("category") or _get("categoryName") or "",
+        "isVisible": _get("isVisible", True),
+        "createdAt": _get("createdAt"),
+    }
 
 
 @router.get("/{item_id}")
 async def get_gallery_item(request: Request, item_id: str):
     db = get_db_or_503(request)
-    try:
-        doc = await db.gallery.find_one({"_id": ObjectId(item_id)})
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid id")
-    if not doc:
-        raise HTTPException(status_code=404, detail="Not found")
-    return serialize_doc(doc)
+    body = _ITEM_CACHE.get(item_id.lower())
+    if body is None:
+        doc = await db.gallery.find_one({"_id": oid_or_400(item_id)})
+        if not doc:
+            raise HTTPException(status_code=404, detail="Not found")
+        body = doc_response(doc).body
+        _ITEM_CACHE.set(item_id.lower(), body)
+    return Response(body, media_type="application/json")
 
 
 @router.post("/", dependencies=[Depends(admin_key_dep)])
 async def create_gallery_item(request: Request, imageUrl: Optional[str] = Form(None), file: Optional[UploadFile] = File(None), caption: Optional[str] = Form(None), category: Optional[str] = Form(None), isVisible: bool = Form(True)):
     db = get_db_or_503(request)
+    now = datetime.now(timezone.utc)
     final_url = imageUrl
+    content_hash = None
     if file is not None:
         # save file
-        filename = f"{int(datetime.utcnow().timestamp())}_{file.filename}"
+        filename = f"{int(now.timestamp())}_{file.filename}"
         dest = os.path.join(UPLOAD_DIR, filename)
-        with open(dest, "wb") as f:
-            f.write(await file.read())
-        # public path served at /uploads/gallery/<filename>
-        final_url = f"/uploads/gallery/{filename}"
+        part = os.path.join(UPLOAD_TMP_DIR, f"{ObjectId()}.part")
+        # Stream the spooled upload to disk off the event loop, hashing as it goes
+        async with _upload_slot():
+            await file.seek(0)
+            content_hash = await run_in_threadpool(_copy_stream, file.file, part)
+        same = await db.gallery.find_one({"content_hash": content_hash}, {"imageUrl": 1})
+        if same and same.get("imageUrl"):
+            # Identical bytes are already published; point at that file instead
+            await run_in_threadpool(os.remove, part)
+            final_url = same["imageUrl"]
+        else:
+            await run_in_threadpool(shutil.move, part, dest)
+            # public path served at /uploads/gallery/<filename>
+            final_url = f"/uploads/gallery/{filename}"
 
     if not final_url:
         raise HTTPException(status_code=400, detail="imageUrl or file required")
@@ -105,38 +254,221 @@ async def create_gallery_item(request: Request, imageUrl: Optional[str] = Form(N
         "caption": caption,
         "category": category,
         "isVisible": bool(isVisible),
-        "createdAt": datetime.utcnow(),
-        "updatedAt": datetime.utcnow()
+        "createdAt": now,
+        "updatedAt": now
     }
+    if content_hash:
+        doc["content_hash"] = content_hash
     res = await db.gallery.insert_one(doc)
+    _LIST_CACHE.clear()
     doc["_id"] = res.inserted_id
     return serialize_doc(doc)
 
 
+class GalleryItemIn(BaseModel):
+    imageUrl: str
+    caption: Optional[str] = None
+    description: Optional[str] = None
+    category: Optional[str] = None
+    isVisible: bool = True
+
+
+@router.post("/bulk", dependencies=[Depends(admin_key_dep)])
+async def create_gallery_items_bulk(request: Request, items: List[GalleryItemIn]):
+    """Insert a batch of gallery items (e.g. an album whose files were uploaded
+    via /gallery/uploads) with a single insert_many."""
+    db = get_db_or_503(request)
+    if not items:
+        raise HTTPException(status_code=400, detail="No items given")
+    now = datetime.now(timezone.utc)
+    docs = [{**item.dict(), "createdAt": now, "updatedAt": now} for item in items]
+    res = await db.gallery.insert_many(docs, ordered=False)
+    _LIST_CACHE.clear()
+    return {"inserted": len(res.inserted_ids), "ids": [str(i) for i in res.inserted_ids]}
+
+
 @router.put("/{item_id}", dependencies=[Depends(admin_key_dep)])
 async def update_gallery_item(request: Request, item_id: str, payload: dict):
     db = get_db_or_503(request)
-    payload["updatedAt"] = datetime.utcnow()
+    payload["updatedAt"] = datetime.now(timezone.utc)
     # do not allow _id changes
     payload.pop("id", None)
     payload.pop("_id", None)
-    try:
-        res = await db.gallery.update_one({"_id": ObjectId(item_id)}, {"$set": payload})
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid id")
-    if res.matched_count == 0:
+    oid = oid_or_400(item_id)
+    doc = await db.gallery.find_one_and_update({"_id": oid}, {"$set": payload}, return_document=ReturnDocument.AFTER)
+    _LIST_CACHE.clear()
+    _ITEM_CACHE.pop(item_id.lower())
+    if doc is None:
         raise HTTPException(status_code=404, detail="Not found")
-    doc = await db.gallery.find_one({"_id": ObjectId(item_id)})
     return serialize_doc(doc)
 
 
 @router.delete("/{item_id}", dependencies=[Depends(admin_key_dep)])
 async def delete_gallery_item(request: Request, item_id: str):
     db = get_db_or_503(request)
-    try:
-        res = await db.gallery.delete_one({"_id": ObjectId(item_id)})
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid id")
+    res = await db.gallery.delete_one({"_id": oid_or_400(item_id)})
+    _LIST_CACHE.clear()
+    _ITEM_CACHE.pop(item_id.lower())
     if res.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Not found")
     return {"deleted": True}
+
+
+# --- Resumable uploads -------------------------------------------------------
+# POST /gallery/uploads starts an upload, PATCH /gallery/uploads/{id} stores a
+# byte range (Content-Range: bytes a-b/total; ranges may arrive in any order or
+# in parallel, and a failed one is simply re-sent), and
+# POST /gallery/uploads/{id}/commit publishes the file as a gallery item.
+# Upload state lives in the `gallery_uploads` collection so it survives restarts.
+# Uploads left idle for UPLOAD_TTL_SECONDS are dropped: the doc by a TTL index
+# on `updatedAt`, the .part file by sweep_stale_uploads() at startup.
+
+UPLOAD_TTL_SECONDS = int(os.getenv("UPLOAD_TTL_SECONDS", "86400"))
+
+_CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class UploadInit(BaseModel):
+    filename: str
+    size: int
+    caption: Optional[str] = None
+    category: Optional[str] = None
+    isVisible: bool = True
+
+
+def _part_path(upload_id: ObjectId) -> str:
+    return os.path.join(UPLOAD_TMP_DIR, f"{upload_id}.part")
+
+
+def _write_at(path: str, offset: int, data: bytes) -> None:
+    # r+b keeps bytes already written by other ranges
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+
+def _create_part(path: str, size: int) -> None:
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def _covered(ranges: List[List[int]]) -> int:
+    """Number of distinct bytes covered by inclusive [start, end] ranges."""
+    total = 0
+    reach = -1
+    for start, end in sorted(ranges):
+        if end > reach:
+            total += end - max(start, reach + 1) + 1
+            reach = end
+    return total
+
+
+async def _get_upload(db, upload_id: str) -> dict:
+    doc = await db.gallery_uploads.find_one({"_id": oid_or_400(upload_id, "Invalid upload id")})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return doc
+
+
+@router.post("/uploads", dependencies=[Depends(admin_key_dep)])
+async def start_upload(request: Request, body: UploadInit):
+    db = get_db_or_503(request)
+    if body.size <= 0:
+        raise HTTPException(status_code=400, detail="size must be positive")
+    if body.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"size exceeds the {MAX_UPLOAD_BYTES} byte limit")
+    upload_id = ObjectId()
+    await run_in_threadpool(_create_part, _part_path(upload_id), body.size)
+    doc = body.dict()
+    now = datetime.now(timezone.utc)
+    doc.update({"_id": upload_id, "ranges": [], "createdAt": now, "updatedAt": now})
+    await db.gallery_uploads.insert_one(doc)
+    return {"id": str(upload_id), "url": f"/gallery/uploads/{upload_id}", "size": body.size}
+
+
+@router.patch("/uploads/{upload_id}", dependencies=[Depends(admin_key_dep)])
+async def upload_range(request: Request, upload_id: str):
+    db = get_db_or_503(request)
+    upload = await _get_upload(db, upload_id)
+    m = _CONTENT_RANGE.match(request.headers.get("content-range", ""))
+    if not m:
+        raise HTTPException(status_code=400, detail="Content-Range: bytes a-b/total required")
+    start, end, total = (int(g) for g in m.groups())
+    if total != upload["size"] or start > end or end >= total:
+        raise HTTPException(status_code=416, detail="Range does not fit the upload")
+    if request.headers.get("content-length") != str(end - start + 1):
+        raise HTTPException(status_code=400, detail="Content-Length must match Content-Range")
+    path = _part_path(upload["_id"])
+    offset = start
+    async with _upload_slot():
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            if offset + len(chunk) > end + 1:
+                raise HTTPException(status_code=400, detail="Body is longer than Content-Range")
+            try:
+                await run_in_threadpool(_write_at, path, offset, chunk)
+            except FileNotFoundError:
+                # committed (file moved) or expired while this range was streaming
+                raise HTTPException(status_code=409, detail="Upload is no longer open")
+            offset += len(chunk)
+    if offset != end + 1:
+        raise HTTPException(status_code=400, detail="Body is shorter than Content-Range")
+    updated = await db.gallery_uploads.find_one_and_update(
+        {"_id": upload["_id"]},
+        {"$push": {"ranges": [start, end]}, "$set": {"updatedAt": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated is None:
+        raise HTTPException(status_code=409, detail="Upload is no longer open")
+    return {"id": upload_id, "received": _covered(updated["ranges"]), "size": upload["size"]}
+
+
+@router.post("/uploads/{upload_id}/commit", dependencies=[Depends(admin_key_dep)])
+async def commit_upload(request: Request, upload_id: str):
+    db = get_db_or_503(request)
+    upload = await _get_upload(db, upload_id)
+    if _covered(upload["ranges"]) != upload["size"]:
+        raise HTTPException(status_code=409, detail="Upload is incomplete")
+    # Claim the upload before touching the file so only one commit moves it
+    if await db.gallery_uploads.find_one_and_delete({"_id": upload["_id"]}, {"_id": 1}) is None:
+        raise HTTPException(status_code=409, detail="Upload is no longer open")
+    now = datetime.now(timezone.utc)
+    filename = f"{int(now.timestamp())}_{os.path.basename(upload['filename'])}"
+    try:
+        await run_in_threadpool(shutil.move, _part_path(upload["_id"]), os.path.join(UPLOAD_DIR, filename))
+    except OSError:
+        # put the claim back so the client can retry the commit
+        await db.gallery_uploads.insert_one(upload)
+        raise HTTPException(status_code=500, detail="Failed to store upload")
+    doc = {
+        "imageUrl": f"/uploads/gallery/{filename}",
+        "caption": upload.get("caption"),
+        "category": upload.get("category"),
+        "isVisible": bool(upload.get("isVisible", True)),
+        "createdAt": now,
+        "updatedAt": now
+    }
+    res = await db.gallery.insert_one(doc)
+    _LIST_CACHE.clear()
+    doc["_id"] = res.inserted_id
+    return serialize_doc(doc)
+
+
+def _sweep_parts(max_age: float) -> int:
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in os.scandir(UPLOAD_TMP_DIR):
+        if entry.name.endswith(".part") and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+async def sweep_stale_uploads() -> int:
+    """Delete .part files not written to for UPLOAD_TTL_SECONDS; their
+    `gallery_uploads` docs expire through the TTL index."""
+    return await run_in_threadpool(_sweep_parts, UPLOAD_TTL_SECONDS)
@@ -6,12 +6,11 @@ Requires env var `INTERNAL_API_KEY` (optional). The endpoint is:
 GET /internal/db-status
 Header: X-Internal-Key: <key>
 
-This implementation attempts to support both motor (async) and pymongo (sync) MongoDB clients.
+This implementation attempts to support both async (PyMongo AsyncMongoClient) and sync MongoDB clients.
 """
 from fastapi import APIRouter, Header, HTTPException, Request
 from pydantic import BaseModel
 import os
-import asyncio
 
 router = APIRouter(prefix="/internal", tags=["internal"])
 
@@ -33,15 +32,9 @@ async def db_status(request: Request, x_internal_key: str | None = Header(None))
     if client is None:
         raise HTTPException(status_code=503, detail={"error":"db_unavailable","message":"db client missing"})
 
-    # Try pinging the MongoDB server. Support both async motor client and sync pymongo client.
+    # The client is pymongo's AsyncMongoClient, so the ping runs on the event loop.
     try:
-        cmd_result = client.admin.command("ping")
-        if asyncio.iscoroutine(cmd_result):
-            await cmd_result
-        else:
-            # sync pymongo call -> run in threadpool to avoid blocking
-            loop = asyncio.get_running_loop()
-            await loop.run_in_executor(None, lambda: client.admin.command("ping"))
+        await client.admin.command("ping")
     except Exception:
         raise HTTPException(status_code=503, detail={"error":"db_unavailable"})
 
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, HTTPException, Request
-from bson import ObjectId
-from datetime import datetime
-from utils import get_db_or_503, serialize_doc
+from fastapi import APIRouter, HTTPException, Request, Query
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pymongo import ReturnDocument
+from typing import Optional
+from datetime import datetime, timezone
+import orjson
+from utils import get_db_or_503, serialize_doc, encode_doc, doc_response, oid_or_400, encode_after, after_filter, TTLCache, WORKER_COUNT
 
-router = APIRouter(prefix="/menu-items", tags=["menu-items"])
+router = APIRouter(prefix="/menu-items", tags=["menu-items"], default_response_class=ORJSONResponse)
 
 # Module-level variable to store database connection
 _db = None
@@ -13,62 +16,107 @@ def set_db(database):
     global _db
     _db = database
 
+# Encoded single items by lowercased id; dropped on update/delete. Only the
+# worker that handled the write drops its copy, so with several workers
+# (WEB_CONCURRENCY > 1) the cache is off rather than up to 60s stale.
+_ITEM_CACHE = TTLCache(ttl=60.0, maxsize=1024 if WORKER_COUNT == 1 else 0)
+
+_NEWEST_FIRST = [("created_at", -1), ("_id", -1)]
+MAX_PAGE_SIZE = 500
+DEFAULT_PAGE_SIZE = 100
+
 @router.get("/")
-async def get_all_menu_items(request: Request):
-    """Get all menu items"""
+async def get_all_menu_items(request: Request, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
+    """Get menu items, newest first.
+
+    Without parameters this is the full list, as before (streamed, so memory
+    stays at one cursor batch). `limit` caps it; passing `after` (empty to
+    start) returns `{items, nextCursor}` pages of `limit` (default 100)
+    instead, like /gallery.
+    """
     db = get_db_or_503(request)
+    query = after_filter(after, "created_at") if after else {}
+    cursor_mode = after is not None
+    cursor = db["menu_items"].find(query).sort(_NEWEST_FIRST)
+    if cursor_mode:
+        limit = limit or DEFAULT_PAGE_SIZE
+        # one look-ahead item tells whether there is a next page
+        cursor = cursor.limit(limit + 1)
+    elif limit:
+        cursor = cursor.limit(limit)
     try:
-        menu_items = await db["menu_items"].find().to_list(None)
-        return [serialize_doc(item) for item in menu_items]
+        # first batch is read up front so a failing query is a 500, not a cut-off body
+        first = await anext(cursor, None)
     except Exception:
+        await cursor.close()
         raise HTTPException(status_code=500, detail="Failed to fetch menu items")
 
+    async def gen():
+        try:
+            yield b'{"items":[' if cursor_mode else b"["
+            doc, n, last = first, 0, None
+            while doc is not None:
+                if cursor_mode and n == limit:
+                    break
+                # encode_doc pops _id, so keep the sort key for the next-page token
+                last = {"_id": doc.get("_id"), "created_at": doc.get("created_at")}
+                yield (b"," if n else b"") + encode_doc(doc)
+                n += 1
+                doc = await anext(cursor, None)
+            if cursor_mode:
+                next_cursor = encode_after(last, "created_at") if doc is not None and last is not None else None
+                yield b'],"nextCursor":' + orjson.dumps(next_cursor) + b"}"
+            else:
+                yield b"]"
+        finally:
+            await cursor.close()
+
+    return StreamingResponse(gen(), media_type="application/json")
+
 @router.get("/{menu_item_id}")
 async def get_menu_item(request: Request, menu_item_id: str):
     """Get a specific menu item by ID"""
     db = get_db_or_503(request)
-    try:
-        menu_item = await db["menu_items"].find_one({"_id": ObjectId(menu_item_id)})
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid menu item id")
-    if not menu_item:
-        raise HTTPException(status_code=404, detail="Menu item not found")
-    return serialize_doc(menu_item)
+    body = _ITEM_CACHE.get(menu_item_id.lower())
+    if body is None:
+        menu_item = await db["menu_items"].find_one({"_id": oid_or_400(menu_item_id, "Invalid menu item id")})
+        if not menu_item:
+            raise HTTPException(status_code=404, detail="Menu item not found")
+        body = doc_response(menu_item).body
+        _ITEM_CACHE.set(menu_item_id.lower(), body)
+    return Response(body, media_type="application/json")
 
 @router.post("/")
 async def create_menu_item(request: Request, menu_item: dict):
     """Create a new menu item"""
     db = get_db_or_503(request)
     item_dict = menu_item
-    item_dict["created_at"] = datetime.utcnow()
-    result = await db["menu_items"].insert_one(item_dict)
-    created = await db["menu_items"].find_one({"_id": result.inserted_id})
-    return serialize_doc(created)
+    item_dict["created_at"] = datetime.now(timezone.utc)
+    # insert_one sets the generated _id on item_dict; no need to read it back
+    await db["menu_items"].insert_one(item_dict)
+    return serialize_doc(item_dict)
 
 @router.put("/{menu_item_id}")
 async def update_menu_item(request: Request, menu_item_id: str, menu_item: dict):
     """Update a menu item"""
     db = get_db_or_503(request)
-    try:
-        result = await db["menu_items"].update_one(
-            {"_id": ObjectId(menu_item_id)},
-            {"$set": menu_item}
-        )
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid menu item id")
-    if result.matched_count == 0:
+    oid = oid_or_400(menu_item_id, "Invalid menu item id")
+    updated = await db["menu_items"].find_one_and_update(
+        {"_id": oid},
+        {"$set": menu_item},
+        return_document=ReturnDocument.AFTER,
+    )
+    _ITEM_CACHE.pop(menu_item_id.lower())
+    if updated is None:
         raise HTTPException(status_code=404, detail="Menu item not found")
-    updated = await db["menu_items"].find_one({"_id": ObjectId(menu_item_id)})
     return serialize_doc(updated)
 
 @router.delete("/{menu_item_id}")
 async def delete_menu_item(request: Request, menu_item_id: str):
     """Delete a menu item"""
     db = get_db_or_503(request)
-    try:
-        result = await db["menu_items"].delete_one({"_id": ObjectId(menu_item_id)})
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid menu item id")
+    result = await db["menu_items"].delete_one({"_id": oid_or_400(menu_item_id, "Invalid menu item id")})
+    _ITEM_CACHE.pop(menu_item_id.lower())
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Menu item not found")
     return {"message": "Menu item deleted successfully"}
@@ -107,6 +107,7 @@ async def ota_webhook(request: Request):
     booking_doc = {
         "guest_name": guest_name or "",
         "guest_email": guest_email or "",
+        "guest_email_lc": (guest_email or "").lower(),
         "guest_phone": guest_phone or "",
         "accommodation_id": accommodation_id,
         "check_in": ci,
@@ -122,10 +123,10 @@ async def ota_webhook(request: Request):
         lock_key = f"accom:{accommodation_id}:{ci.date().isoformat()}:{co.date().isoformat()}"
         lock_owner = None
         # prefer transactions when available
-        if client is not None and hasattr(client, "start_session"):
+        if client is not None and getattr(request.app.state, "supports_txn", False):
             try:
                 async with client.start_session() as session:
-                    async with session.start_transaction():
+                    async with await session.start_transaction():
                         res = await db["bookings"].insert_one(booking_doc, session=session)
                         booking_id = res.inserted_id
                         # per-night occupancies
@@ -182,7 +183,7 @@ async def ota_webhook(request: Request):
             raise HTTPException(status_code=500, detail="Mapped booking not found")
         # For simplicity, support modified -> update dates/price and cancelled handled earlier
         try:
-            await db["bookings"].update_one({"_id": b_id}, {"$set": {"check_in": ci, "check_out": co, "total_price": total_price, "guest_name": guest_name, "guest_email": guest_email}})
+            await db["bookings"].update_one({"_id": b_id}, {"$set": {"check_in": ci, "check_out": co, "total_price": total_price, "guest_name": guest_name, "guest_email": guest_email, "guest_email_lc": (guest_email or "").lower()}})
             await db["ota_bookings"].update_one({"_id": existing["_id"]}, {"$set": {"updated_at": datetime.utcnow(), "status": status}})
             updated = await db["bookings"].find_one({"_id": b_id})
             return serialize_doc(updated)
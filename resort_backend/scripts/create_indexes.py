@@ -25,6 +25,24 @@ db["bookings"].create_index([
 	("check_out", pymongo.ASCENDING),
 ], name="accom_checkin_checkout_idx")
 
+# Status + date-overlap index for availability filtering on room listings
+db["bookings"].create_index([
+	("status", pymongo.ASCENDING),
+	("check_in", pymongo.ASCENDING),
+	("check_out", pymongo.ASCENDING),
+], name="bookings_status_dates_idx")
+
+# Overlap/conflict checks for both booking paths, plus guest/user lookups
+db["bookings"].create_indexes([
+	pymongo.IndexModel([("accommodation_id", pymongo.ASCENDING), ("status", pymongo.ASCENDING), ("check_in", pymongo.ASCENDING), ("check_out", pymongo.ASCENDING)], name="bookings_accom_status_dates_idx"),
+	pymongo.IndexModel([("allocated_cottages", pymongo.ASCENDING), ("status", pymongo.ASCENDING), ("check_in", pymongo.ASCENDING), ("check_out", pymongo.ASCENDING)], name="bookings_alloc_status_dates_idx"),
+	pymongo.IndexModel([("guest_email_lc", pymongo.ASCENDING)], name="bookings_guest_email_lc_idx"),
+	pymongo.IndexModel([("user_id", pymongo.ASCENDING)], name="bookings_user_id_idx"),
+])
+
+# Rooms are looked up by their parent accommodation
+db["rooms"].create_index([("accommodation_id", pymongo.ASCENDING)], name="rooms_accommodation_id_idx")
+
 # Per-night occupancy index to prevent double-booking at the granularity of a room-night
 db["occupancies"].create_index([
 	("accommodation_id", pymongo.ASCENDING),
@@ -35,16 +53,32 @@ db["occupancies"].create_index([
 db["locks"].create_index([("key", pymongo.ASCENDING)], name="locks_key_unique", unique=True)
 db["locks"].create_index([("expire_at", pymongo.ASCENDING)], name="locks_expire_ttl", expireAfterSeconds=0)
 
-	# Ensure users and guests have indexes on email for fast lookup and uniqueness where appropriate
-	try:
-		db["users"].create_index([("email", pymongo.ASCENDING)], name="users_email_idx", unique=True)
-	except Exception:
-		# ignore if index exists or collection missing
-		pass
-
-	try:
-		db["guests"].create_index([("email", pymongo.ASCENDING)], name="guests_email_idx")
-	except Exception:
-		pass
+# Case-insensitive name lookups; queries must pass the same collation to use these.
+NAME_COLLATION = {"locale": "en", "strength": 2}
+db["rooms"].create_index([("name", pymongo.ASCENDING)], name="rooms_name_ci", collation=NAME_COLLATION)
+db["accommodations"].create_index([("name", pymongo.ASCENDING)], name="accommodations_name_ci", collation=NAME_COLLATION)
+
+# Gallery listing (filter by category/visibility, newest first) and menu items
+db["gallery"].update_many({"isVisible": {"$exists": False}}, {"$set": {"isVisible": True}})
+db["gallery"].create_indexes([
+	pymongo.IndexModel([("category", pymongo.ASCENDING), ("isVisible", pymongo.ASCENDING), ("createdAt", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)], name="gallery_category_visible_created_idx"),
+	pymongo.IndexModel([("isVisible", pymongo.ASCENDING), ("createdAt", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)], name="gallery_visible_created_idx"),
+])
+db["gallery"].create_index([("content_hash", pymongo.ASCENDING)], name="gallery_content_hash_idx", sparse=True)
+db["menu_items"].create_index([("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)], name="menu_items_created_id_idx")
+# Abandoned resumable gallery uploads expire after UPLOAD_TTL_SECONDS of inactivity
+db["gallery_uploads"].create_index([("updatedAt", pymongo.ASCENDING)], name="gallery_uploads_ttl_idx", expireAfterSeconds=int(os.getenv("UPLOAD_TTL_SECONDS", "86400")))
+
+# Ensure users and guests have indexes on email for fast lookup and uniqueness where appropriate
+try:
+	db["users"].create_index([("email", pymongo.ASCENDING)], name="users_email_idx", unique=True)
+except Exception:
+	# ignore if index exists or collection missing
+	pass
+
+try:
+	db["guests"].create_index([("email", pymongo.ASCENDING)], name="guests_email_idx")
+except Exception:
+	pass
 
 print("Indexes created.")
@@ -35,3 +35,103 @@ def test_preferred_room_types():
     alloc = allocate_rooms(rooms, 4, preferred_room_types=["large"])
     assert len(alloc) == 1
     assert str(alloc[0]) == "000000000000000000000002"
+
+
+# --- allocate_rooms against brute force --------------------------------------
+import itertools
+import random
+
+from routes import api_compat
+
+
+def _cost(rooms, ids):
+    """(room count, total price) of an allocation; what allocate_rooms minimises."""
+    by_id = {r["_id"]: r for r in rooms}
+    assert len(set(ids)) == len(ids)
+    return len(ids), sum(by_id[i]["price_per_night"] for i in ids)
+
+
+def _brute_force(rooms, guests):
+    """Fewest rooms, then lowest price, over every subset; None if nothing fits."""
+    for k in range(1, len(rooms) + 1):
+        fits = [c for c in itertools.combinations(rooms, k) if sum(r["capacity"] for r in c) >= guests]
+        if fits:
+            return k, min(sum(r["price_per_night"] for r in c) for c in fits)
+    return None
+
+
+def _random_rooms(rng, n, max_cap=5):
+    return [{"_id": ObjectId(), "capacity": rng.randint(0, max_cap), "price_per_night": rng.randint(1, 300)} for _ in range(n)]
+
+
+def _assert_optimal(rooms, guests, **kw):
+    ids = allocate_rooms(rooms, guests, **kw)
+    expected = _brute_force(rooms, guests)
+    if expected is None:
+        assert ids == []
+    else:
+        assert _cost(rooms, ids) == expected
+
+
+def test_matches_brute_force_on_small_inventories():
+    rng = random.Random(7)
+    for _ in range(300):
+        rooms = _random_rooms(rng, rng.randint(1, 8))
+        _assert_optimal(rooms, rng.randint(1, 16))
+
+
+def test_tie_break_prefers_fewer_rooms_then_price():
+    one_big = make_room("000000000000000000000001", 4, 500)
+    small = [make_room(f"00000000000000000000000{i}", 2, p) for i, p in ((2, 60), (3, 40), (4, 50))]
+    # one pricier room beats two cheaper ones
+    assert [str(i) for i in allocate_rooms([one_big] + small, 4)] == ["000000000000000000000001"]
+    # among equal-size allocations the cheapest pair wins
+    assert sorted(str(i) for i in allocate_rooms(small, 4)) == ["000000000000000000000003", "000000000000000000000004"]
+
+
+def test_preferred_types_restrict_then_fall_back():
+    rng = random.Random(11)
+    for _ in range(100):
+        rooms = _random_rooms(rng, rng.randint(2, 8))
+        for r in rooms:
+            r["type"] = rng.choice(["villa", "hut"])
+        guests = rng.randint(1, 10)
+        villas = [r for r in rooms if r["type"] == "villa"]
+        ids = allocate_rooms(rooms, guests, preferred_room_types=["Villa"])
+        if villas:
+            # only preferred rooms are considered while any exist
+            assert set(ids) <= {r["_id"] for r in villas}
+            expected = _brute_force(villas, guests)
+            assert (ids == []) if expected is None else _cost(rooms, ids) == expected
+        else:
+            _assert_optimal(rooms, guests)
+    # no room matches the preference: every candidate is considered
+    rooms = [make_room("000000000000000000000001", 2, 50, slug="small")]
+    assert len(allocate_rooms(rooms, 2, preferred_room_types=["large"])) == 1
+
+
+def test_more_than_ten_candidates_uses_knapsack(monkeypatch):
+    calls = []
+    real = api_compat._min_cover
+    monkeypatch.setattr(api_compat, "_min_cover", lambda *a: calls.append(a) or real(*a))
+    rng = random.Random(3)
+    for _ in range(20):
+        # distinct capacities so the per-capacity pruning keeps > 10 candidates
+        caps = rng.sample(range(1, 30), 12)
+        rooms = [{"_id": ObjectId(), "capacity": c, "price_per_night": rng.randint(1, 300)} for c in caps]
+        _assert_optimal(rooms, rng.randint(30, 120))
+    assert calls
+
+
+def test_large_tables_fall_back_to_greedy(monkeypatch):
+    monkeypatch.setattr(api_compat, "_min_cover", lambda *a: pytest.fail("knapsack should be skipped"))
+    rng = random.Random(5)
+    # 300 rooms x 1000 guests is past the 250k-cell knapsack limit
+    rooms = [{"_id": ObjectId(), "capacity": rng.randint(1, 8), "price_per_night": rng.randint(1, 300)} for _ in range(300)]
+    assert len(rooms) * 1000 > api_compat._DP_MAX_CELLS
+    ids = allocate_rooms(rooms, 1000)
+    by_id = {r["_id"]: r for r in rooms}
+    assert len(set(ids)) == len(ids)
+    assert sum(by_id[i]["capacity"] for i in ids) >= 1000
+    # not enough beds in total: nothing is allocated
+    assert allocate_rooms(rooms, sum(r["capacity"] for r in rooms) + 1) == []
@@ -0,0 +1,57 @@
+import os
+import pytest
+from datetime import datetime, timedelta
+from httpx import AsyncClient, ASGITransport
+from pymongo import MongoClient
+
+import sys
+# Ensure resort_backend package path is importable when running pytest from repo root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from main import app
+
+
+@pytest.mark.asyncio
+async def test_guest_lookup_follows_email_edit():
+    mongo_url = os.getenv("MONGODB_URL")
+    assert mongo_url is not None, "MONGODB_URL must be set to run this test"
+    db_name = os.getenv("DATABASE_NAME", "resort_db")
+    client = MongoClient(mongo_url)
+    db = client[db_name]
+
+    db.bookings.delete_many({"accommodation_id": "email-edit-room"})
+    db.occupancies.delete_many({"accommodation_id": "email-edit-room"})
+
+    # Ensure app has DB attached when using ASGITransport (lifespan may not run in some test harnesses)
+    from database import connect_db, get_db
+    await connect_db()
+    app.state.db = get_db()
+    app.state.db_client = getattr(__import__("database"), "client", None)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        check_in = (datetime.utcnow() + timedelta(days=6)).replace(hour=14, minute=0, second=0, microsecond=0)
+        check_out = check_in + timedelta(days=1)
+        payload = {
+            "guest_name": "Email Editor",
+            "guest_email": "Old.Address@example.com",
+            "guest_phone": "000",
+            "accommodation_id": "email-edit-room",
+            "check_in": check_in.isoformat(),
+            "check_out": check_out.isoformat(),
+            "total_price": 100.0,
+        }
+        r = await ac.post("/bookings/", json=payload)
+        assert r.status_code == 200
+        booking_id = r.json()["id"]
+
+        payload["guest_email"] = "New.Address@example.com"
+        r = await ac.put(f"/bookings/{booking_id}", json=payload)
+        assert r.status_code == 200
+
+        r = await ac.get("/bookings/guest/new.address@example.com")
+        assert [b["id"] for b in r.json()] == [booking_id]
+        r = await ac.get("/bookings/guest/old.address@example.com")
+        assert r.json() == []
+
+    db.bookings.delete_many({"accommodation_id": "email-edit-room"})
+    db.occupancies.delete_many({"accommodation_id": "email-edit-room"})
+    client.close()
@@ -24,3 +24,29 @@ async def test_accommodations_db_unavailable(monkeypatch):
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
         r = await ac.get("/accommodations/")
         assert r.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_site_config_js_is_cacheable():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.get("/site/site-config.js")
+        assert r.status_code == 200
+        assert r.text.startswith("window.__SITE_CONFIG__ = ")
+        assert r.headers.get("etag")
+        assert "max-age" in r.headers.get("cache-control", "")
+        r2 = await ac.get("/site/site-config.js", headers={"If-None-Match": r.headers["etag"]})
+        assert r2.status_code == 304
+
+
+@pytest.mark.asyncio
+async def test_api_site_config_js_not_modified():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.get("/api/site/site-config.js")
+        assert r.status_code == 200
+        etag = r.headers.get("etag")
+        assert etag
+        r2 = await ac.get("/api/site/site-config.js", headers={"If-None-Match": etag})
+        assert r2.status_code == 304
+        assert r2.content == b""
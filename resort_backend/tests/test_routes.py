@@ -0,0 +1,21 @@
+from routes.api_compat import router
+
+
+def test_api_compat_has_no_shadowed_routes():
+    seen = set()
+    for route in router.routes:
+        for method in route.methods:
+            key = (route.path, method)
+            assert key not in seen, f"duplicate handler for {method} {route.path}"
+            seen.add(key)
+
+
+def test_app_has_no_shadowed_routes():
+    from main import app
+
+    seen = set()
+    for route in app.routes:
+        for method in getattr(route, "methods", None) or ():
+            key = (route.path, method)
+            assert key not in seen, f"duplicate handler for {method} {route.path}"
+            seen.add(key)
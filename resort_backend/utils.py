@@ -1,11 +1,96 @@
 from fastapi import Request, HTTPException
-from typing import Any, Dict
+from fastapi.responses import Response
+from typing import Any, Awaitable, Callable, Dict, List
+import asyncio
 import logging
-from bson import ObjectId
-from datetime import datetime, date
+import os
+import re
+import time
+from bson import ObjectId, Decimal128
+from datetime import datetime, date, timedelta
+from functools import lru_cache
+import orjson
 
 logger = logging.getLogger("resort_backend.utils")
 
+# Case-insensitive collation for name lookups. Queries only use the
+# `name` indexes when they pass this exact collation.
+NAME_COLLATION = {"locale": "en", "strength": 2}
+
+# Worker processes (uvicorn/gunicorn WEB_CONCURRENCY). In-process caches are
+# only invalidated in the worker that handled the write, so caches that must
+# be read-your-writes are turned off when there is more than one.
+WORKER_COUNT = int(os.getenv("WEB_CONCURRENCY") or 1)
+
+
+@lru_cache(maxsize=4096)
+def parse_oid(s: str) -> ObjectId:
+    """ObjectId(s), memoised. Ids repeat a lot across requests and ObjectId is
+    immutable, so the hex validation only runs once per id. Invalid input
+    still raises bson.errors.InvalidId / TypeError (exceptions aren't cached)."""
+    return ObjectId(s)
+
+
+_OID_HEX = re.compile(r"[0-9a-fA-F]{24}")
+
+
+def oid_or_400(value: str, detail: str = "Invalid id") -> ObjectId:
+    """Parse a path id, answering 400 for anything that isn't 24 hex digits.
+
+    The regex rejects bad ids without building (and throwing) InvalidId;
+    good ones go through the memoised ``parse_oid``.
+    """
+    if not _OID_HEX.fullmatch(value):
+        raise HTTPException(status_code=400, detail=detail)
+    return parse_oid(value)
+
+
+# str(request.base_url) without the trailing slash, per (scheme, host, server, root_path)
+_BASE_PREFIXES: Dict[tuple, str] = {}
+
+
+def base_url_prefix(request: Request) -> str:
+    """``str(request.base_url).rstrip('/')``, memoised on the scope fields it
+    depends on so list endpoints don't rebuild the URL on every request."""
+    scope = request.scope
+    server = scope.get("server")
+    # ASGI allows `server` as a list or a tuple; the key has to be hashable
+    key = (scope.get("scheme"), request.headers.get("host"), tuple(server) if server else None, scope.get("root_path", ""))
+    prefix = _BASE_PREFIXES.get(key)
+    if prefix is None:
+        prefix = str(request.base_url).rstrip("/")
+        if len(_BASE_PREFIXES) < 64:  # Host is client-supplied; don't grow without bound
+            _BASE_PREFIXES[key] = prefix
+    return prefix
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def encode_after(doc: Dict[str, Any], field: str) -> str:
+    """Opaque keyset token for the (``field``, _id) position of ``doc``."""
+    created = doc.get(field)
+    ms = (created - _EPOCH) // timedelta(milliseconds=1) if isinstance(created, datetime) else ""
+    return f"{ms}_{doc['_id']}"
+
+
+def after_filter(token: str, field: str) -> Dict[str, Any]:
+    """Filter for docs strictly after ``token`` in (``field`` desc, _id desc) order."""
+    try:
+        ms, oid = token.split("_", 1)
+        oid = ObjectId(oid)
+        ts = _EPOCH + timedelta(milliseconds=int(ms)) if ms else None
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if ts is None:
+        # docs without the timestamp sort last
+        return {field: None, "_id": {"$lt": oid}}
+    return {"$or": [
+        {field: {"$lt": ts}},
+        {field: ts, "_id": {"$lt": oid}},
+        {field: None},
+    ]}
+
 
 def get_db_or_503(request: Request):
     db = getattr(request.app.state, "db", None)
@@ -50,6 +135,107 @@ def serialize_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
     return out
 
 
+def _bson_default(o: Any):
+    """orjson fallback for BSON types it doesn't know natively."""
+    if isinstance(o, (ObjectId, Decimal128)):
+        return str(o)
+    raise TypeError
+
+
+def docs_response(docs: List[Dict[str, Any]]) -> Response:
+    """Encode raw MongoDB documents straight to a JSON response.
+
+    Same output shape as ``[serialize_doc(d) for d in docs]`` (``_id`` becomes
+    ``id``), but nested values are converted inside orjson instead of by a
+    per-document Python walk.
+    """
+    for d in docs:
+        _id = d.pop("_id", None)
+        if _id is not None:
+            d["id"] = str(_id)
+    return Response(orjson.dumps(docs, default=_bson_default), media_type="application/json")
+
+
+class TTLCache:
+    """Tiny in-process cache for read-mostly endpoints.
+
+    Entries expire ``ttl`` seconds after they were loaded. Concurrent misses on a
+    key share one in-flight load, so a cold key is fetched once, not once per
+    request, and a slow load never holds up other keys.
+    ``generation`` goes up on every ``clear()``; callers that render outside the
+    cache compare it before storing so they don't re-insert pre-clear data.
+    ``maxsize=0`` disables storing.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 8):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: Dict[Any, tuple] = {}
+        self.generation = 0
+        self._loading: Dict[Any, asyncio.Future] = {}
+
+    def _fresh(self, key):
+        hit = self._data.get(key)
+        if hit is not None and time.monotonic() - hit[0] < self.ttl:
+            return hit
+        return None
+
+    def get(self, key, default=None):
+        hit = self._fresh(key)
+        return default if hit is None else hit[1]
+
+    def set(self, key, value) -> None:
+        if self.maxsize <= 0:
+            return  # disabled
+        # Re-inserting keeps the dict in load order, so the first key is the oldest.
+        self._data.pop(key, None)
+        if len(self._data) >= self.maxsize:
+            del self._data[next(iter(self._data))]
+        self._data[key] = (time.monotonic(), value)
+
+    def pop(self, key, default=None):
+        hit = self._data.pop(key, None)
+        return default if hit is None else hit[1]
+
+    async def get_or_load(self, key, loader: Callable[[], Awaitable[Any]]):
+        hit = self._fresh(key)
+        if hit is not None:
+            return hit[1]
+        task = self._loading.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, loader))
+            # mark a failure as seen even if every waiter was cancelled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._loading[key] = task
+        # shield: one waiter being cancelled must not cancel the shared load
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader):
+        try:
+            value = await loader()
+            self.set(key, value)
+            return value
+        finally:
+            self._loading.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+        self.generation += 1
+
+
+def encode_doc(doc: Dict[str, Any]) -> bytes:
+    """JSON bytes for one raw document, in the ``docs_response`` shape."""
+    _id = doc.pop("_id", None)
+    if _id is not None:
+        doc["id"] = str(_id)
+    return orjson.dumps(doc, default=_bson_default)
+
+
+def doc_response(doc: Dict[str, Any]) -> Response:
+    """Single-document counterpart of ``docs_response``."""
+    return Response(encode_doc(doc), media_type="application/json")
+
+
 def hash_password(password: str) -> str:
     # lightweight PBKDF2 password hashing to avoid extra deps
     import hashlib, os, binascii